@@ -5,7 +5,7 @@ Runs as an HTTP server that provides cached auth tokens.
 Automatically refreshes tokens before expiry.
 
 Features:
-    - Persistent browser sessions (storageState) to avoid re-login/2FA
+    - Persistent browser sessions (live context + storageState) to avoid re-login/2FA
     - Twilio SMS auto-read for MMI 2FA codes
     - Proactive background token refresh
     - Retry with exponential backoff
@@ -13,15 +13,29 @@ Features:
     - Enhanced health endpoint
 
 Usage:
+    pip install -r requirements-token-service.txt
+    playwright install chromium
     python token_service.py
 
+Requires aiohttp and Playwright; orjson and uvloop are used when installed.
+
 Environment Variables:
     MMI_EMAIL - MMI login email
     MMI_PASSWORD - MMI login password
     RPR_EMAIL - RPR login email
     RPR_PASSWORD - RPR login password
+    RPR_HUMAN_TYPING - Set to 1 to type RPR credentials key by key (default: instant fill)
     TOKEN_SERVICE_PORT - Port to run on (default: 8899)
     TOKEN_SERVICE_SECRET - Secret key for API authentication
+    TOKEN_SERVICE_SOCKET - Optional UNIX socket path for on-host clients (served alongside TCP)
+    TOKEN_SERVICE_LOG_LEVEL - Log level (default: INFO, DEBUG for page dumps)
+    TOKEN_CACHE_PATH - Token cache file (default: browser_state/tokens.json)
+    MMI_LOGIN_API_URL - Optional MMI JSON login endpoint tried before the browser flow
+    BLOCKED_RESOURCE_TYPES - Comma-separated resource types aborted in the browser
+        (default: image,font,media)
+    PLAYWRIGHT_CHROMIUM_PATH - Chromium binary to launch instead of Playwright's lookup
+    PLAYWRIGHT_BROWSERS_PATH - Playwright's own browser install dir; point it at a
+        persistent volume so container rebuilds don't re-run `playwright install`
     TWILIO_ACCOUNT_SID - Twilio account SID (for 2FA auto-read)
     TWILIO_AUTH_TOKEN - Twilio auth token
     TWILIO_2FA_PHONE_NUMBER - Phone number receiving 2FA SMS (Twilio number)
@@ -39,37 +53,116 @@ Endpoints:
 """
 
 import asyncio
+import atexit
+import hashlib
+import hmac
+import itertools
 import json
+import logging
 import os
+import queue
 import re
 import sys
 import time
-import threading
-import uuid
-import traceback
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
 from datetime import datetime, timedelta
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import unquote, parse_qs, urlencode
+from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import unquote, parse_qs
 from pathlib import Path
 
 try:
-    import urllib.request
-    import urllib.error
-    import base64
+    import aiohttp
+    from aiohttp import web
 except ImportError:
-    pass
+    # Logging isn't set up yet; say what to install instead of a bare traceback
+    sys.exit("[TokenService] ERROR: aiohttp not installed! Run: pip3 install -r requirements-token-service.txt")
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# =============================================================================
+# LOGGING
+# =============================================================================
+
+# Records are queued on the event loop and formatted/written to stderr by a
+# listener thread, so a log call never blocks on the stderr write.
+LOG_LEVEL = os.environ.get("TOKEN_SERVICE_LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = 10000
 
-# Token storage
-tokens = {
-    "mmi": {"token": None, "expiresAt": 0, "lastError": None, "lastRefresh": None, "retryCount": 0},
-    "rpr": {"token": None, "expiresAt": 0, "lastError": None, "lastRefresh": None, "retryCount": 0},
-}
 
-# Pending 2FA sessions - stores browser context waiting for 2FA
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+log_queue = queue.Queue(LOG_QUEUE_SIZE)
+stderr_handler = logging.StreamHandler(sys.stderr)
+stderr_handler.setFormatter(logging.Formatter("%(message)s"))
+log_listener = QueueListener(log_queue, stderr_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+logger = logging.getLogger("tokensvc")
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(DroppingQueueHandler(log_queue))
+logger.propagate = False
+
+# Token storage. Entries are immutable snapshots; writers publish a new one with a
+# single dict assignment, so readers never need a lock.
+@dataclass(frozen=True, slots=True)
+class TokenEntry:
+    token: str | None = None
+    expires_at: int = 0  # epoch ms
+    last_error: str | None = None
+    last_refresh: str | None = None  # ISO timestamp
+    retry_count: int = 0
+
+
+tokens = {"mmi": TokenEntry(), "rpr": TokenEntry()}
+
+# Pending 2FA sessions - each owns a browser context (detached from the provider
+# cache) waiting for 2FA, keyed by integer handle
 pending_2fa_sessions = {}
+session_handles = itertools.count(1)
+
+# Shared Playwright driver and Chromium process, launched once and reused
+shared_playwright = None
+shared_browser = None
+browser_lock = asyncio.Lock()
 
-# Lock for thread safety
-token_lock = threading.Lock()
+# Live browser contexts kept between refreshes, keyed by provider
+browser_sessions = {}
+session_locks = {"mmi": asyncio.Lock(), "rpr": asyncio.Lock()}
+
+# Per-provider locks serializing token state writers; readers take no lock
+# because entries are frozen and swapped whole (see TokenEntry)
+token_locks = {"mmi": asyncio.Lock(), "rpr": asyncio.Lock()}
+
+# In-flight refresh per provider; concurrent callers (requests, the daemon,
+# /tokens/refresh) await the same task instead of starting another login
+refresh_tasks = {"mmi": None, "rpr": None}
+
+# Consecutive failed refreshes per provider and the monotonic time before which
+# background refreshes (the daemon and stale-token requests) hold off, so a
+# broken login isn't re-run (and re-alerted) on every check or request
+refresh_failures = {"mmi": 0, "rpr": 0}
+refresh_retry_at = {"mmi": 0.0, "rpr": 0.0}
+
+# Each provider's browser flow runs one at a time; MMI and RPR run independently
+extract_semaphores = {"mmi": asyncio.Semaphore(1), "rpr": asyncio.Semaphore(1)}
 
 # Service start time
 SERVICE_START_TIME = datetime.now()
@@ -77,12 +170,48 @@ SERVICE_START_TIME = datetime.now()
 # Configuration
 SERVICE_SECRET = os.environ.get("TOKEN_SERVICE_SECRET", "tcds_token_service_2025")
 REFRESH_BUFFER_SECONDS = 600  # Refresh 10 min before expiry
-PROACTIVE_CHECK_INTERVAL = 300  # Check every 5 minutes
+PROACTIVE_CHECK_INTERVAL = 30  # Check every 30 seconds
+REFRESH_RETRY_DELAYS = (5, 15, 45)  # Seconds between refresh attempts
+PROACTIVE_REFRESH_MARGIN = 600  # Daemon refreshes this long before requests would
+PROACTIVE_BACKOFF_MAX = 1800  # Cap on the background-refresh wait after repeated failures
+PENDING_2FA_TTL_SECONDS = 600  # Abandoned 2FA sessions are closed after 10 min
+PENDING_2FA_REAP_INTERVAL = 60
+MAX_PENDING_2FA_SESSIONS = 3  # Oldest prompt is closed when a new one would exceed this
 
 # Browser state directory for persistent sessions
 BROWSER_STATE_DIR = Path(os.environ.get("BROWSER_STATE_DIR", "browser_state"))
 BROWSER_STATE_DIR.mkdir(parents=True, exist_ok=True)
 
+# Explicit Chromium binary (e.g. a system or volume-mounted install); empty uses Playwright's
+CHROMIUM_EXECUTABLE_PATH = os.environ.get("PLAYWRIGHT_CHROMIUM_PATH") or None
+
+# Headless login only needs the page itself; skip GPU, extensions and Chrome's
+# background services. --single-process/--no-zygote are left out on purpose:
+# they are unstable with the several contexts the shared browser hosts.
+CHROMIUM_ARGS = [
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-networking",
+    # Pages in the second provider's context or a pending 2FA tab count as
+    # background; keep their timers and rendering at full speed
+    "--disable-renderer-backgrounding",
+    "--disable-background-timer-throttling",
+    "--disable-backgrounding-occluded-windows",
+    "--disable-sync",
+    "--disable-translate",
+    "--disable-default-apps",
+    "--no-first-run",
+    "--mute-audio",
+    "--disable-features=TranslateUI",
+    "--disable-blink-features=AutomationControlled",
+]
+
+# Last good tokens, so a restart can reuse a still-valid token instead of logging in again
+TOKEN_CACHE_PATH = Path(os.environ.get("TOKEN_CACHE_PATH", str(BROWSER_STATE_DIR / "tokens.json")))
+
 # Twilio config
 TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID", "")
 TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN", "")
@@ -96,38 +225,67 @@ OUTLOOK_SENDER_EMAIL = os.environ.get("OUTLOOK_SENDER_EMAIL", "")
 
 try:
     from playwright.async_api import async_playwright
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
     PLAYWRIGHT_AVAILABLE = True
 except ImportError:
     PLAYWRIGHT_AVAILABLE = False
-    print("[TokenService] WARNING: Playwright not installed", file=sys.stderr)
+    logger.warning("[TokenService] WARNING: Playwright not installed")
+
+
+# =============================================================================
+# OUTBOUND HTTP
+# =============================================================================
+
+# One pooled client for Twilio, Graph and direct logins, so repeat calls reuse
+# keep-alive connections and cached DNS instead of a fresh TLS handshake each time
+http_session = None
+
+
+def get_http_session():
+    """Return the shared outbound ClientSession, creating it on first use.
+    Cookies are not kept between calls; callers read Set-Cookie off the response."""
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300, keepalive_timeout=60),
+            cookie_jar=aiohttp.DummyCookieJar(),
+            timeout=aiohttp.ClientTimeout(total=20),
+        )
+    return http_session
+
+
+async def close_http_session():
+    global http_session
+    if http_session is not None:
+        await http_session.close()
+        http_session = None
 
 
 # =============================================================================
 # TWILIO SMS HELPER
 # =============================================================================
 
-def fetch_latest_2fa_code(since_seconds=120):
+# 4-8 digit verification code in an SMS body
+SMS_CODE_RE = re.compile(r"\b(\d{4,8})\b")
+
+
+async def fetch_latest_2fa_code(since_seconds=120):
     """Poll Twilio Messages API for the most recent SMS containing a 2FA code."""
     if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_2FA_PHONE_NUMBER:
-        print("[Twilio] Not configured, skipping SMS auto-read", file=sys.stderr)
+        logger.info("[Twilio] Not configured, skipping SMS auto-read")
         return None
 
     try:
         since_time = datetime.utcnow() - timedelta(seconds=since_seconds)
         date_sent = since_time.strftime("%Y-%m-%d")
 
-        url = (
-            f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}"
-            f"/Messages.json?To={TWILIO_2FA_PHONE_NUMBER}&DateSent>={date_sent}&PageSize=5"
-        )
-
-        credentials = base64.b64encode(
-            f"{TWILIO_ACCOUNT_SID}:{TWILIO_AUTH_TOKEN}".encode()
-        ).decode()
+        url = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
+        params = {"To": TWILIO_2FA_PHONE_NUMBER, "DateSent>": date_sent, "PageSize": "5"}
+        auth = aiohttp.BasicAuth(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 
-        req = urllib.request.Request(url, headers={"Authorization": f"Basic {credentials}"})
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode())
+        async with get_http_session().get(url, params=params, auth=auth, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+            resp.raise_for_status()
+            data = await resp.json(content_type=None, loads=json_loads)
 
         messages = data.get("messages", [])
         # Sort by date_sent descending
@@ -136,17 +294,17 @@ def fetch_latest_2fa_code(since_seconds=120):
         for msg in messages:
             body = msg.get("body", "")
             # Look for 4-8 digit codes
-            match = re.search(r'\b(\d{4,8})\b', body)
+            match = SMS_CODE_RE.search(body)
             if match:
                 code = match.group(1)
-                print(f"[Twilio] Found 2FA code: {code} from message: {body[:80]}", file=sys.stderr)
+                logger.info(f"[Twilio] Found 2FA code: {code} from message: {body[:80]}")
                 return code
 
-        print("[Twilio] No 2FA code found in recent messages", file=sys.stderr)
+        logger.info("[Twilio] No 2FA code found in recent messages")
         return None
 
     except Exception as e:
-        print(f"[Twilio] Error fetching SMS: {e}", file=sys.stderr)
+        logger.error(f"[Twilio] Error fetching SMS: {e}")
         return None
 
 
@@ -154,35 +312,36 @@ def fetch_latest_2fa_code(since_seconds=120):
 # EMAIL ALERTING (Microsoft Graph)
 # =============================================================================
 
-def send_alert_email(subject, body_text):
+async def send_alert_email(subject, body_text):
     """Send alert email via Microsoft Graph API using client credentials."""
     if not OUTLOOK_TENANT_ID or not OUTLOOK_CLIENT_ID or not OUTLOOK_CLIENT_SECRET or not OUTLOOK_SENDER_EMAIL:
-        print(f"[Alert] Email not configured, would have sent: {subject}", file=sys.stderr)
+        logger.info(f"[Alert] Email not configured, would have sent: {subject}")
         return False
 
     try:
+        http = get_http_session()
+        timeout = aiohttp.ClientTimeout(total=10)
+
         # Step 1: Get access token
         token_url = f"https://login.microsoftonline.com/{OUTLOOK_TENANT_ID}/oauth2/v2.0/token"
-        token_data = urlencode({
+        token_data = {
             "client_id": OUTLOOK_CLIENT_ID,
             "client_secret": OUTLOOK_CLIENT_SECRET,
             "scope": "https://graph.microsoft.com/.default",
             "grant_type": "client_credentials",
-        }).encode()
+        }
 
-        req = urllib.request.Request(token_url, data=token_data, method="POST")
-        req.add_header("Content-Type", "application/x-www-form-urlencoded")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            token_result = json.loads(resp.read().decode())
+        async with http.post(token_url, data=token_data, timeout=timeout) as resp:
+            token_result = await resp.json(content_type=None, loads=json_loads)
 
         access_token = token_result.get("access_token")
         if not access_token:
-            print(f"[Alert] Failed to get Graph token: {token_result}", file=sys.stderr)
+            logger.error(f"[Alert] Failed to get Graph token: {token_result}")
             return False
 
         # Step 2: Send email
         send_url = f"https://graph.microsoft.com/v1.0/users/{OUTLOOK_SENDER_EMAIL}/sendMail"
-        email_payload = json.dumps({
+        email_payload = {
             "message": {
                 "subject": subject,
                 "body": {"contentType": "Text", "content": body_text},
@@ -190,19 +349,17 @@ def send_alert_email(subject, body_text):
                     {"emailAddress": {"address": OUTLOOK_SENDER_EMAIL}}
                 ],
             }
-        }).encode()
+        }
 
-        req = urllib.request.Request(send_url, data=email_payload, method="POST")
-        req.add_header("Authorization", f"Bearer {access_token}")
-        req.add_header("Content-Type", "application/json")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            pass  # 202 Accepted
+        headers = {"Authorization": f"Bearer {access_token}"}
+        async with http.post(send_url, json=email_payload, headers=headers, timeout=timeout) as resp:
+            resp.raise_for_status()  # 202 Accepted
 
-        print(f"[Alert] Email sent: {subject}", file=sys.stderr)
+        logger.info(f"[Alert] Email sent: {subject}")
         return True
 
     except Exception as e:
-        print(f"[Alert] Failed to send email: {e}", file=sys.stderr)
+        logger.error(f"[Alert] Failed to send email: {e}")
         return False
 
 
@@ -210,78 +367,121 @@ def send_alert_email(subject, body_text):
 # 2FA DETECTION
 # =============================================================================
 
+TWOFA_SELECTORS = (
+    'input[name="code"]', 'input[name="otp"]', 'input[name="totp"]',
+    'input[name="2fa"]', 'input[name="mfaCode"]', 'input[name="mfa_code"]',
+    'input[name="verificationCode"]', 'input[name="verification_code"]',
+    'input[name="twoFactorCode"]',
+    'input[placeholder*="code" i]', 'input[placeholder*="verification" i]',
+    'input[placeholder*="digit" i]',
+    'input[aria-label*="code" i]', 'input[aria-label*="verification" i]',
+    'input[aria-label*="digit" i]',
+    'input[type="tel"][maxlength="6"]', 'input[type="tel"][maxlength="1"]',
+    'input[type="number"][maxlength="1"]',
+    'input[autocomplete="one-time-code"]',
+    'input[inputmode="numeric"][maxlength="6"]',
+    'input[inputmode="numeric"][maxlength="1"]',
+    'input.otp-input', 'input.code-input', 'input.verification-input',
+    'input.digit-input',
+    '[data-testid*="otp"]', '[data-testid*="code"]', '[data-testid*="2fa"]',
+)
+
+# Joined once so the page parses the selector list and walks the DOM a single time
+TWOFA_SELECTOR = ", ".join(TWOFA_SELECTORS)
+
+# Locates the 2FA code input in a single page.evaluate round trip: the first
+# visible, non-email/password element matching `selector`, else a row of 4+
+# visible single-digit boxes. When `code` is given the input(s) are filled too.
+TWOFA_INPUT_JS = """
+({selector, code}) => {
+    const isVisible = (el) => el.getClientRects().length > 0 && getComputedStyle(el).visibility !== 'hidden';
+    const typeOf = (el) => (el.getAttribute('type') || '').toLowerCase();
+    const fill = (el, value) => {
+        const setter = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+        el.focus();
+        setter.call(el, value);
+        el.dispatchEvent(new Event('input', {bubbles: true}));
+        el.dispatchEvent(new Event('change', {bubbles: true}));
+    };
+
+    for (const el of document.querySelectorAll(selector)) {
+        const type = typeOf(el);
+        const name = (el.getAttribute('name') || '').toLowerCase();
+        if (!isVisible(el) || type === 'email' || type === 'password' ||
+            name.includes('email') || name.includes('password')) {
+            continue;
+        }
+        if (code && !(el instanceof HTMLInputElement)) continue;
+        if (code) fill(el, code);
+        const label = el.tagName.toLowerCase() + (name ? `[name="${name}"]` : '') + (type ? `[type="${type}"]` : '');
+        return {input: label, digits: 0};
+    }
+
+    const digits = Array.from(document.querySelectorAll('input[maxlength="1"]'))
+        .filter((el) => isVisible(el) && typeOf(el) !== 'email' && typeOf(el) !== 'password');
+    if (digits.length < 4) return null;
+    if (code) {
+        if (code.length < digits.length) return null;
+        digits.forEach((el, i) => fill(el, code[i]));
+    }
+    return {input: null, digits: digits.length};
+}
+"""
+
+TWOFA_KEYWORDS = (
+    "verification code", "two-factor", "2fa", "two factor",
+    "enter code", "security code", "authentication code",
+    "one-time password", "one-time code", "mfa", "multi-factor",
+    "sent to your email", "sent to your phone", "sent a code",
+    "6-digit", "6 digit", "enter the code", "verify your identity",
+    "additional verification", "confirm it's you", "we need to verify",
+)
+
+# Pages and API calls that only exist during a verification step
+TWOFA_URL_RE = re.compile(r"/(?:mfa|2fa|otp|verify|verification|challenge)(?:[/?#.-]|$)", re.IGNORECASE)
+
+# Visible body text, truncated and lowercased in the browser before transfer
+PAGE_TEXT_LIMIT = 20000
+PAGE_TEXT_JS = "limit => (document.body ? document.body.innerText : '').slice(0, limit).toLowerCase()"
+
+# One case-insensitive pass over the page text instead of a substring scan per keyword
+TWOFA_KEYWORD_RE = re.compile("|".join(re.escape(k) for k in TWOFA_KEYWORDS), re.IGNORECASE)
+
+
 async def detect_2fa_challenge(page):
     """Check if page shows 2FA/verification code input"""
-    page_lower = ""
+    if TWOFA_URL_RE.search(page.url):
+        logger.debug(f"[2FA-Detect] 2FA URL: {page.url}")
+        return True
+
     try:
-        page_text = await page.inner_text("body")
-        page_lower = page_text.lower()
-        print(f"[2FA-Detect] Page text length: {len(page_text)}", file=sys.stderr)
-        print(f"[2FA-Detect] First 500 chars: {page_text[:500]}", file=sys.stderr)
+        match = await page.evaluate(TWOFA_INPUT_JS, {"selector": TWOFA_SELECTOR, "code": None})
+        if match and match["input"]:
+            logger.debug(f"[2FA-Detect] Found 2FA input: {match['input']}")
+            return True
+        if match:
+            logger.debug(f"[2FA-Detect] Found {match['digits']} digit input boxes")
+            return True
     except Exception as e:
-        print(f"[2FA-Detect] Could not get page text: {e}", file=sys.stderr)
-
-    twofa_selectors = [
-        'input[name="code"]', 'input[name="otp"]', 'input[name="totp"]',
-        'input[name="2fa"]', 'input[name="mfaCode"]', 'input[name="mfa_code"]',
-        'input[name="verificationCode"]', 'input[name="verification_code"]',
-        'input[name="twoFactorCode"]',
-        'input[placeholder*="code" i]', 'input[placeholder*="verification" i]',
-        'input[placeholder*="digit" i]',
-        'input[aria-label*="code" i]', 'input[aria-label*="verification" i]',
-        'input[aria-label*="digit" i]',
-        'input[type="tel"][maxlength="6"]', 'input[type="tel"][maxlength="1"]',
-        'input[type="number"][maxlength="1"]',
-        'input[autocomplete="one-time-code"]',
-        'input[inputmode="numeric"][maxlength="6"]',
-        'input[inputmode="numeric"][maxlength="1"]',
-        'input.otp-input', 'input.code-input', 'input.verification-input',
-        'input.digit-input',
-        '[data-testid*="otp"]', '[data-testid*="code"]', '[data-testid*="2fa"]',
-    ]
-
-    for selector in twofa_selectors:
-        try:
-            el = await page.query_selector(selector)
-            if el and await el.is_visible():
-                input_type = await el.get_attribute("type")
-                input_name = await el.get_attribute("name") or ""
-                if input_type not in ["email", "password"] and "email" not in input_name.lower() and "password" not in input_name.lower():
-                    print(f"[2FA-Detect] Found 2FA input: {selector}", file=sys.stderr)
-                    return True
-        except:
-            continue
+        logger.warning(f"[2FA-Detect] Input scan failed: {e}")
 
-    # Check for multiple digit input boxes
+    # Only fall back to the keyword scan when no input matched; the text is
+    # capped and lowercased in the page so only a small string crosses IPC.
+    page_text = ""
     try:
-        digit_inputs = await page.query_selector_all('input[maxlength="1"]')
-        visible_digit_inputs = 0
-        for inp in digit_inputs:
-            if await inp.is_visible():
-                inp_type = await inp.get_attribute("type")
-                if inp_type not in ["email", "password"]:
-                    visible_digit_inputs += 1
-        if visible_digit_inputs >= 4:
-            print(f"[2FA-Detect] Found {visible_digit_inputs} digit input boxes", file=sys.stderr)
-            return True
-    except:
-        pass
+        page_text = await page.evaluate(PAGE_TEXT_JS, PAGE_TEXT_LIMIT)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[2FA-Detect] Page text length: {len(page_text)}")
+            logger.debug(f"[2FA-Detect] First 500 chars: {page_text[:500]}")
+    except Exception as e:
+        logger.warning(f"[2FA-Detect] Could not get page text: {e}")
 
-    twofa_keywords = [
-        "verification code", "two-factor", "2fa", "two factor",
-        "enter code", "security code", "authentication code",
-        "one-time password", "one-time code", "mfa", "multi-factor",
-        "sent to your email", "sent to your phone", "sent a code",
-        "6-digit", "6 digit", "enter the code", "verify your identity",
-        "additional verification", "confirm it's you", "we need to verify",
-    ]
-
-    for keyword in twofa_keywords:
-        if keyword in page_lower:
-            print(f"[2FA-Detect] Found keyword: '{keyword}'", file=sys.stderr)
-            return True
+    keyword_match = TWOFA_KEYWORD_RE.search(page_text)
+    if keyword_match:
+        logger.debug(f"[2FA-Detect] Found keyword: '{keyword_match.group(0)}'")
+        return True
 
-    print("[2FA-Detect] No 2FA challenge detected", file=sys.stderr)
+    logger.debug("[2FA-Detect] No 2FA challenge detected")
     return False
 
 
@@ -289,6 +489,68 @@ async def detect_2fa_challenge(page):
 # PERSISTENT BROWSER SESSION HELPERS
 # =============================================================================
 
+# Only API calls carry the Bearer header; request listeners bail out early for
+# everything else (documents, scripts, styles...) without touching headers.
+API_RESOURCE_TYPES = frozenset({"xhr", "fetch"})
+
+# Authorization header values; MMI tokens are only trusted past 20 characters
+BEARER_RE = re.compile(r"Bearer (\S+)")
+MMI_BEARER_RE = re.compile(r"Bearer (\S{21,})")
+
+# Web-storage keys that may hold the token, most frequent hit first
+STORAGE_TOKEN_KEYS = {
+    "mmi": ["token", "accessToken", "access_token", "jwt", "bearerToken", "authToken", "api_key"],
+    "rpr": ["token", "accessToken", "access_token", "jwt", "bearerToken", "authToken"],
+}
+
+# Cookie names (matched against document.cookie) that may hold the token
+STORAGE_TOKEN_COOKIE_RE = {
+    "mmi": "null",
+    "rpr": "/token|jwt/i",
+}
+
+# Installed once per context with the provider's keys inlined, so each lookup
+# only ships a one-line call instead of re-sending and re-parsing the scan.
+# Returns {token, source} or null.
+STORAGE_TOKEN_INIT_JS = """
+window.__tcdsExtractToken = () => {
+    const keys = __KEYS__;
+    for (const key of keys) {
+        let t = localStorage.getItem(key) || sessionStorage.getItem(key);
+        if (t && t.length > 20) return {token: t, source: 'storage'};
+    }
+    for (let i = 0; i < localStorage.length; i++) {
+        const key = localStorage.key(i);
+        const val = localStorage.getItem(key);
+        if (val && val.startsWith('eyJ') && val.length > 50) return {token: val, source: 'storage'};
+    }
+    const cookieName = __COOKIE_RE__;
+    if (cookieName) {
+        for (const part of document.cookie.split(';')) {
+            const eq = part.indexOf('=');
+            if (eq < 0) continue;
+            const val = part.slice(eq + 1).trim();
+            if (!cookieName.test(part.slice(0, eq).trim()) || val.length <= 50) continue;
+            try {
+                return {token: decodeURIComponent(val), source: 'cookie'};
+            } catch (e) {
+                return {token: val, source: 'cookie'};
+            }
+        }
+    }
+    return null;
+};
+"""
+STORED_TOKEN_JS = "() => window.__tcdsExtractToken ? window.__tcdsExtractToken() : null"
+
+# Requests the login flows never need. Stylesheets are loaded by default because
+# the 2FA and button checks rely on CSS visibility; add "stylesheet" via the env
+# var if a provider's login is known to work without it.
+BLOCKED_RESOURCE_TYPES = frozenset(
+    t.strip() for t in os.environ.get("BLOCKED_RESOURCE_TYPES", "image,font,media").split(",") if t.strip()
+)
+TRACKER_URL_RE = re.compile(r"googletagmanager|google-analytics|doubleclick|hotjar|segment\.(?:io|com)")
+
 def get_storage_state_path(provider):
     """Get path to persistent storage state file for a provider."""
     return BROWSER_STATE_DIR / f"{provider}_storage_state.json"
@@ -305,11 +567,27 @@ async def create_context_with_state(browser, provider):
     if state_path.exists():
         try:
             context_opts["storage_state"] = str(state_path)
-            print(f"[{provider.upper()}] Restoring storage state from {state_path}", file=sys.stderr)
+            logger.info(f"[{provider.upper()}] Restoring storage state from {state_path}")
         except Exception as e:
-            print(f"[{provider.upper()}] Failed to load storage state: {e}", file=sys.stderr)
+            logger.warning(f"[{provider.upper()}] Failed to load storage state: {e}")
+
+    context = await browser.new_context(**context_opts)
+    await context.route("**/*", block_unneeded_requests)
+    await context.add_init_script(
+        STORAGE_TOKEN_INIT_JS
+        .replace("__KEYS__", json.dumps(STORAGE_TOKEN_KEYS[provider]))
+        .replace("__COOKIE_RE__", STORAGE_TOKEN_COOKIE_RE[provider])
+    )
+    return context
+
 
-    return await browser.new_context(**context_opts)
+async def block_unneeded_requests(route):
+    """Abort images/fonts/media and analytics beacons; let documents, scripts and XHR through."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or TRACKER_URL_RE.search(request.url):
+        await route.abort()
+    else:
+        await route.continue_()
 
 
 async def save_storage_state(context, provider):
@@ -317,39 +595,412 @@ async def save_storage_state(context, provider):
     state_path = get_storage_state_path(provider)
     try:
         await context.storage_state(path=str(state_path))
-        print(f"[{provider.upper()}] Storage state saved to {state_path}", file=sys.stderr)
+        logger.info(f"[{provider.upper()}] Storage state saved to {state_path}")
     except Exception as e:
-        print(f"[{provider.upper()}] Failed to save storage state: {e}", file=sys.stderr)
+        logger.warning(f"[{provider.upper()}] Failed to save storage state: {e}")
+
+
+async def get_browser():
+    """Get the shared Chromium instance, starting Playwright on first use."""
+    global shared_playwright, shared_browser
+
+    async with browser_lock:
+        if shared_browser is not None and not shared_browser.is_connected():
+            # Chromium crashed or was killed; launch a new one below
+            logger.warning("[TokenService] Shared Chromium disconnected, relaunching")
+            shared_browser = None
+        if shared_browser is None:
+            if shared_playwright is None:
+                shared_playwright = await async_playwright().start()
+            shared_browser = await shared_playwright.chromium.launch(
+                headless=True,
+                executable_path=CHROMIUM_EXECUTABLE_PATH,
+                args=CHROMIUM_ARGS,
+            )
+            logger.info("[TokenService] Launched shared Chromium instance")
+
+    return shared_browser
+
+
+async def warm_up_browser():
+    """Launch the shared browser at startup so the first refresh doesn't pay Chromium's cold start."""
+    try:
+        await get_browser()
+    except Exception as e:
+        logger.warning(f"[TokenService] Browser warm-up failed, will retry on first refresh: {e}")
+
+
+async def shutdown_browser():
+    """Close all cached contexts, the shared browser and the Playwright driver."""
+    global shared_playwright, shared_browser
+
+    for provider in list(browser_sessions):
+        await close_browser_session(provider)
+
+    if shared_browser:
+        try:
+            await shared_browser.close()
+        except Exception:
+            pass
+        shared_browser = None
+    if shared_playwright:
+        try:
+            await shared_playwright.stop()
+        except Exception:
+            pass
+        shared_playwright = None
+
+
+async def get_browser_session(provider):
+    """Get the cached browser session for a provider, creating its context if needed.
+    Keeping the context alive between refreshes means most refreshes land on an
+    already-authenticated page instead of repeating the full login flow."""
+    async with session_locks[provider]:
+        session = browser_sessions.get(provider)
+        if session and session["browser"].is_connected():
+            return session
+        if session:
+            # The context died with its browser; nothing left to close
+            browser_sessions.pop(provider)
+            logger.warning(f"[{provider.upper()}] Dropped browser context from a disconnected browser")
+
+        browser = await get_browser()
+        context = await create_context_with_state(browser, provider)
+        session = {"browser": browser, "context": context}
+        browser_sessions[provider] = session
+        logger.info(f"[{provider.upper()}] Created browser context")
+        return session
+
+
+async def close_browser_session(provider):
+    """Close and forget a provider's cached context (e.g. after an auth failure).
+    The shared browser stays up for the next refresh."""
+    async with session_locks[provider]:
+        session = browser_sessions.pop(provider, None)
+
+    if not session:
+        return
+
+    try:
+        await session["context"].close()
+    except Exception:
+        pass
+    logger.info(f"[{provider.upper()}] Closed browser context")
+
+
+async def detach_browser_session(provider, context):
+    """Take context out of the provider's cache without closing it, so its new
+    owner (a pending 2FA session) isn't torn down by close_browser_session and
+    the next refresh logs in on a fresh context instead of reusing its page."""
+    async with session_locks[provider]:
+        session = browser_sessions.get(provider)
+        if session and session["context"] is context:
+            browser_sessions.pop(provider)
+            logger.info(f"[{provider.upper()}] Detached browser context for a pending 2FA session")
+
+
+@asynccontextmanager
+async def provider_page(provider):
+    """Open a page on the provider's cached context for one extraction run.
+    The page is closed on every exit path unless the flow sets run["keep_page"]
+    (a pending 2FA session then owns it, along with its detached context); an
+    exception also drops the context so the next attempt starts from a fresh one."""
+    session = await get_browser_session(provider)
+    context = session["context"]
+    run = {"context": context, "page": None, "keep_page": False}
+    try:
+        run["page"] = await context.new_page()
+        yield run
+    except Exception:
+        await close_browser_session(provider)
+        raise
+    finally:
+        page = run["page"]
+        if page and not run["keep_page"] and not page.is_closed():
+            await page.close()
+
+
+async def find_first_visible(page, selectors):
+    """Return (selector, locator) for the first selector, in priority order,
+    with a visible match, or None if nothing is visible."""
+    for selector in selectors:
+        try:
+            locator = page.locator(f"{selector} >> visible=true").first
+            if await locator.count():
+                return selector, locator
+        except Exception:
+            continue
+    return None
+
+
+async def click_first_present(page, selectors, timeout=10000):
+    """Click the first selector (in priority order) with a visible match and
+    return it, or None if nothing matched. Locator clicks wait inside the page
+    for the button to become enabled, so there is no polling from Python."""
+    for selector in selectors:
+        found = await find_first_visible(page, (selector,))
+        if not found:
+            continue
+        try:
+            await found[1].click(timeout=timeout)
+            return selector
+        except Exception:
+            continue
+    return None
+
+
+async def wait_for_any(*waits):
+    """Run several Playwright waits concurrently and return True as soon as one
+    of them succeeds, cancelling the rest. A wait fails by raising (usually a
+    timeout) or by returning False; returns False if all of them fail."""
+    tasks = [asyncio.ensure_future(w) for w in waits]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                if await next_done is not False:
+                    return True
+            except Exception:
+                continue
+        return False
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def goto_and_wait_for_token(page, url, is_token_request, timeout=20000):
+    """Navigate to url and return as soon as an authenticated API request fires,
+    rather than waiting for networkidle (which SPAs with polling rarely reach).
+    Returns False if no such request was seen before the timeout."""
+    try:
+        async with page.expect_request(is_token_request, timeout=timeout):
+            await page.goto(url, wait_until="domcontentloaded", timeout=timeout)
+        return True
+    except PlaywrightTimeoutError:
+        return False
+
+
+async def race_token_pages(context, page, urls, is_token_request, on_request):
+    """Load several token-triggering URLs at once, one page each, and return as
+    soon as any of them fires an authenticated request. `page` takes the first
+    URL; extra pages share its request handler and are closed afterwards."""
+    extra_pages = []
+    for _ in urls[1:]:
+        extra_page = await context.new_page()
+        extra_page.on("request", on_request)
+        extra_pages.append(extra_page)
+
+    try:
+        return await wait_for_any(*(
+            goto_and_wait_for_token(p, url, is_token_request)
+            for p, url in zip([page] + extra_pages, urls)
+        ))
+    finally:
+        for extra_page in extra_pages:
+            await extra_page.close()
+
+
+async def find_mmi_stored_token(page, context):
+    """Look for the MMI token in web storage and the api_key cookie, reading both concurrently."""
+    found, cookies = await asyncio.gather(
+        page.evaluate(STORED_TOKEN_JS),
+        context.cookies(),
+    )
+    if found:
+        logger.info("[MMI] Found token in storage")
+        return found["token"]
+
+    api_key_cookie = next((c for c in cookies if c["name"] == "api_key"), None)
+    if api_key_cookie:
+        logger.info("[MMI] Found api_key cookie")
+        return unquote(api_key_cookie["value"])
+    return None
+
+
+def is_mmi_token_request(request):
+    """True for an MMI API request carrying a usable Bearer token."""
+    if request.resource_type not in API_RESOURCE_TYPES:
+        return False
+    return "mmi.run" in request.url and MMI_BEARER_RE.fullmatch(request.headers.get("authorization", "")) is not None
+
+
+def is_rpr_token_request(request):
+    """True for an RPR API request carrying a Bearer token."""
+    if request.resource_type not in API_RESOURCE_TYPES:
+        return False
+    url = request.url
+    return ("narrpr.com" in url or "rpr" in url.lower()) and BEARER_RE.fullmatch(request.headers.get("authorization", "")) is not None
+
+
+def is_rpr_login_url(url):
+    """True while the page is still on the NAR SSO / login pages."""
+    url = url.lower()
+    return "login" in url or "logon" in url or "sso" in url or "signin" in url
+
+
+def is_mmi_login_url(url):
+    return "/login" in url.lower()
+
+
+# Per-provider settings for the steps both extractors share: where a logged-in
+# session lands, which page reliably fires an authenticated API call, and how to
+# recognise a token request or a bounce to the login page
+PROVIDERS = {
+    "mmi": {
+        "home_url": "https://new.mmi.run/dashboard",
+        "token_page_url": "https://new.mmi.run/property-search",
+        "is_token_request": is_mmi_token_request,
+        "is_login_url": is_mmi_login_url,
+    },
+    "rpr": {
+        "home_url": "https://www.narrpr.com/home",
+        "token_page_url": "https://www.narrpr.com/search",
+        "is_token_request": is_rpr_token_request,
+        "is_login_url": is_rpr_login_url,
+    },
+}
+
+# Tokens are treated as valid for an hour, less a safety margin
+TOKEN_LIFETIME = timedelta(hours=1, minutes=-5)
+
+
+def token_expiry_ms():
+    return int((datetime.now() + TOKEN_LIFETIME).timestamp() * 1000)
+
+
+async def token_success(context, provider, token):
+    """Persist the session that produced a token and build the success result."""
+    await save_storage_state(context, provider)
+    return {"success": True, "token": token, "expiresAt": token_expiry_ms()}
 
 
 async def check_already_authenticated(page, provider):
     """Check if we're already logged in (session still valid from storageState).
     Uses domcontentloaded instead of networkidle because sites like narrpr.com
     have long-polling requests that prevent networkidle from ever firing."""
+    config = PROVIDERS[provider]
     try:
-        if provider == "mmi":
-            await page.goto("https://new.mmi.run/dashboard", wait_until="domcontentloaded", timeout=20000)
-            await asyncio.sleep(3)
-            if "/login" not in page.url.lower():
-                print(f"[MMI] Already authenticated at {page.url}", file=sys.stderr)
-                return True
-        elif provider == "rpr":
-            await page.goto("https://www.narrpr.com/home", wait_until="domcontentloaded", timeout=20000)
-            await asyncio.sleep(3)
-            current = page.url.lower()
-            if "login" not in current and "sso" not in current and "signin" not in current:
-                print(f"[RPR] Already authenticated at {page.url}", file=sys.stderr)
-                return True
+        await page.goto(config["home_url"], wait_until="domcontentloaded", timeout=20000)
+        # Done as soon as the app calls its API or we're bounced to login
+        await wait_for_any(
+            page.wait_for_event("request", predicate=config["is_token_request"], timeout=5000),
+            page.wait_for_url(config["is_login_url"], wait_until="commit", timeout=5000),
+        )
+        if not config["is_login_url"](page.url):
+            logger.info(f"[{provider.upper()}] Already authenticated at {page.url}")
+            return True
     except Exception as e:
-        print(f"[{provider.upper()}] Auth check failed: {e}", file=sys.stderr)
+        logger.warning(f"[{provider.upper()}] Auth check failed: {e}")
 
     return False
 
 
+async def resume_authenticated_session(page, context, provider, get_captured):
+    """Return a token result from the cached session if it is still logged in,
+    visiting the provider's token page when the landing page made no API call.
+    Returns None when a full login is needed. get_captured reads the token the
+    caller's request hook has seen so far."""
+    if not await check_already_authenticated(page, provider):
+        return None
+
+    if not get_captured():
+        config = PROVIDERS[provider]
+        try:
+            await goto_and_wait_for_token(page, config["token_page_url"], config["is_token_request"])
+        except Exception:
+            pass
+
+    token = get_captured()
+    if token:
+        return await token_success(context, provider, token)
+    return None
+
+
 # =============================================================================
 # MMI TOKEN EXTRACTION
 # =============================================================================
 
+MMI_TOKEN_URLS = [PROVIDERS["mmi"]["home_url"], PROVIDERS["mmi"]["token_page_url"]]
+
+# Selector candidates, tried in order
+MMI_SUBMIT_SELECTORS = (
+    'button[type="submit"]',
+    'button:has-text("Sign In")',
+    'button:has-text("Log In")',
+    'button:has-text("Login")',
+    'input[type="submit"]',
+    'button.login-button',
+    'button.submit-btn',
+    'form button',
+)
+
+# Inner text of the first visible match for each selector, read in a single round trip
+VISIBLE_TEXTS_JS = """
+(selectors) => selectors
+    .map(s => document.querySelector(s))
+    .filter(el => el && el.getClientRects().length > 0 && getComputedStyle(el).visibility !== 'hidden')
+    .map(el => el.innerText)
+"""
+
+MMI_ERROR_SELECTORS = ('.error', '.alert-error', '.text-red', '[role="alert"]', '.error-message', '.login-error')
+
+MMI_SEND_CODE_SELECTORS = (
+    'button:has-text("Send Verification Code")',
+    'button:has-text("Send Code")',
+    'button:has-text("Send OTP")',
+    'button:has-text("Get Code")',
+    'a:has-text("Send Verification Code")',
+)
+
+TWOFA_SUBMIT_SELECTORS = (
+    'button[type="submit"]', 'button:has-text("Verify")',
+    'button:has-text("Submit")', 'button:has-text("Continue")',
+    'button:has-text("Confirm")', 'input[type="submit"]',
+)
+
+# Optional direct login endpoint taking a JSON email/password POST. When set, MMI
+# refreshes try it before driving the browser; any failure falls back to Playwright.
+MMI_LOGIN_API_URL = os.environ.get("MMI_LOGIN_API_URL", "")
+MMI_LOGIN_TOKEN_FIELDS = ("token", "access_token", "accessToken", "api_key")
+
+
+async def login_mmi_direct(email, password):
+    """Log in to MMI with a plain HTTP POST instead of a browser.
+    Returns a token result, or None when the caller should use the browser flow."""
+    try:
+        async with get_http_session().post(MMI_LOGIN_API_URL, json={"email": email, "password": password}) as resp:
+            if resp.status != 200:
+                logger.warning(f"[MMI] Direct login returned HTTP {resp.status}, falling back to browser")
+                return None
+            try:
+                body = await resp.json(content_type=None, loads=json_loads)
+            except ValueError:
+                body = None
+            cookie = resp.cookies.get("api_key")
+    except Exception as e:
+        logger.warning(f"[MMI] Direct login failed, falling back to browser: {e}")
+        return None
+
+    # Token may be at the top level, under "data", or only in an api_key cookie
+    candidates = [body] if isinstance(body, dict) else []
+    if candidates and isinstance(body.get("data"), dict):
+        candidates.append(body["data"])
+    token = next((c[f] for c in candidates for f in MMI_LOGIN_TOKEN_FIELDS if isinstance(c.get(f), str)), None)
+    if token is None and cookie is not None:
+        token = unquote(cookie.value)  # same decoding as find_mmi_stored_token
+    if not token or not MMI_BEARER_RE.fullmatch(f"Bearer {token}"):
+        logger.warning("[MMI] Direct login response had no usable token, falling back to browser")
+        return None
+
+    expires_in = next((c["expires_in"] for c in candidates if isinstance(c.get("expires_in"), int)), None)
+    if expires_in:
+        expires_at = int((time.time() + expires_in - 300) * 1000)
+    else:
+        expires_at = token_expiry_ms()
+    logger.info("[MMI] Token obtained via direct login")
+    return {"success": True, "token": token, "expiresAt": expires_at}
+
+
 async def extract_mmi_token(session_id=None, twofa_code=None):
     """
     Extract Bearer token from MMI login by capturing API request headers.
@@ -370,270 +1021,171 @@ async def extract_mmi_token(session_id=None, twofa_code=None):
     if not email or not password:
         return {"error": "MMI_EMAIL and MMI_PASSWORD required"}
 
+    if MMI_LOGIN_API_URL:
+        result = await login_mmi_direct(email, password)
+        if result:
+            return result
+
     captured_token = None
-    playwright_instance = None
-    browser = None
-    context = None
-    page = None
+    saw_2fa_signal = False
 
     try:
-        playwright_instance = await async_playwright().start()
-        browser = await playwright_instance.chromium.launch(
-            headless=True,
-            args=["--no-sandbox", "--disable-setuid-sandbox", "--disable-dev-shm-usage"]
-        )
+        async with provider_page("mmi") as run:
+            context, page = run["context"], run["page"]
 
-        context = await create_context_with_state(browser, "mmi")
-        page = await context.new_page()
-
-        # Capture Bearer tokens from API requests
-        async def handle_request(request):
-            nonlocal captured_token
-            auth = request.headers.get("authorization", "")
-            if auth.startswith("Bearer ") and "mmi.run" in request.url:
-                token = auth.replace("Bearer ", "")
-                if len(token) > 20:
-                    captured_token = token
-                    print(f"[MMI] Captured token from {request.url}", file=sys.stderr)
-
-        page.on("request", handle_request)
-
-        # Check if already authenticated via persistent session
-        if await check_already_authenticated(page, "mmi"):
-            await asyncio.sleep(2)
-            if captured_token:
-                await save_storage_state(context, "mmi")
-                expires_at = int((datetime.now() + timedelta(hours=1, minutes=-5)).timestamp() * 1000)
-                await browser.close()
-                await playwright_instance.stop()
-                return {"success": True, "token": captured_token, "expiresAt": expires_at}
-
-            # Navigate to trigger API calls
-            try:
-                await page.goto("https://new.mmi.run/property-search", wait_until="networkidle", timeout=20000)
-                await asyncio.sleep(3)
-            except:
-                pass
-
-            if captured_token:
-                await save_storage_state(context, "mmi")
-                expires_at = int((datetime.now() + timedelta(hours=1, minutes=-5)).timestamp() * 1000)
-                await browser.close()
-                await playwright_instance.stop()
-                return {"success": True, "token": captured_token, "expiresAt": expires_at}
-
-        # Not authenticated — do full login
-        print("[MMI] Navigating to login...", file=sys.stderr)
-        await page.goto("https://new.mmi.run/login", wait_until="networkidle", timeout=30000)
-
-        await page.wait_for_selector('input[type="email"], input[name="email"]', timeout=10000)
-
-        print("[MMI] Entering credentials...", file=sys.stderr)
-        await page.fill('input[type="email"], input[name="email"]', email)
-        await page.fill('input[type="password"], input[name="password"]', password)
-
-        submit_selectors = [
-            'button[type="submit"]',
-            'button:has-text("Sign In")',
-            'button:has-text("Log In")',
-            'button:has-text("Login")',
-            'input[type="submit"]',
-            'button.login-button',
-            'button.submit-btn',
-            'form button',
-        ]
+            # Capture Bearer tokens from API requests
+            def handle_request(request):
+                nonlocal captured_token, saw_2fa_signal
+                if request.resource_type not in API_RESOURCE_TYPES:
+                    return
+                if TWOFA_URL_RE.search(request.url):
+                    saw_2fa_signal = True
+                m = MMI_BEARER_RE.fullmatch(request.headers.get("authorization", ""))
+                if m and "mmi.run" in request.url:
+                    captured_token = m.group(1)
+                    logger.debug(f"[MMI] Captured token from {request.url}")
 
-        clicked = False
-        for selector in submit_selectors:
-            try:
-                btn = await page.query_selector(selector)
-                if btn:
-                    await btn.click()
-                    clicked = True
-                    print(f"[MMI] Clicked button with selector: {selector}", file=sys.stderr)
-                    break
-            except:
-                continue
+            page.on("request", handle_request)
 
-        if not clicked:
-            await page.press('input[type="password"]', 'Enter')
-            print("[MMI] Pressed Enter to submit", file=sys.stderr)
+            # Check if already authenticated via persistent session
+            result = await resume_authenticated_session(page, context, "mmi", lambda: captured_token)
+            if result:
+                return result
 
-        await page.wait_for_load_state("networkidle", timeout=15000)
-        await asyncio.sleep(3)
+            # Not authenticated — do full login
+            logger.info("[MMI] Navigating to login...")
+            await page.goto("https://new.mmi.run/login", wait_until="domcontentloaded", timeout=30000)
 
-        print(f"[MMI] After login URL: {page.url}", file=sys.stderr)
+            await page.wait_for_selector('input[type="email"], input[name="email"]', timeout=10000)
 
-        # Check for error messages on the login page
-        if "/login" in page.url:
-            print("[MMI] Still on login page - checking for errors...", file=sys.stderr)
-            error_selectors = ['.error', '.alert-error', '.text-red', '[role="alert"]', '.error-message', '.login-error']
-            for selector in error_selectors:
+            logger.info("[MMI] Entering credentials...")
+            await page.fill('input[type="email"], input[name="email"]', email)
+            await page.fill('input[type="password"], input[name="password"]', password)
+
+            clicked = await click_first_present(page, MMI_SUBMIT_SELECTORS)
+            if clicked:
+                logger.debug(f"[MMI] Clicked button with selector: {clicked}")
+            else:
+                await page.press('input[type="password"]', 'Enter')
+                logger.debug("[MMI] Pressed Enter to submit")
+
+            # Login has moved on once we leave /login, the API is called, or the
+            # password field is replaced (e.g. by an in-place 2FA step)
+            await wait_for_any(
+                page.wait_for_url(lambda url: "/login" not in url, wait_until="commit", timeout=15000),
+                page.wait_for_event("request", predicate=is_mmi_token_request, timeout=15000),
+                page.wait_for_selector('input[type="password"]', state="detached", timeout=15000),
+            )
+            await page.wait_for_load_state("domcontentloaded")
+
+            logger.debug(f"[MMI] After login URL: {page.url}")
+
+            # Check for error messages on the login page
+            if "/login" in page.url:
+                logger.info("[MMI] Still on login page - checking for errors...")
                 try:
-                    err = await page.query_selector(selector)
-                    if err and await err.is_visible():
-                        err_text = await err.inner_text()
-                        print(f"[MMI] Error found: {err_text}", file=sys.stderr)
-                except:
-                    continue
+                    for err_text in await page.evaluate(VISIBLE_TEXTS_JS, list(MMI_ERROR_SELECTORS)):
+                        logger.warning(f"[MMI] Error found: {err_text}")
+                except Exception:
+                    pass
 
-        # Check for 2FA challenge
-        if await detect_2fa_challenge(page):
-            print("[MMI] 2FA challenge detected", file=sys.stderr)
+            # Check for 2FA challenge
+            if saw_2fa_signal or await detect_2fa_challenge(page):
+                logger.info("[MMI] 2FA challenge detected")
 
-            # Click "Send Verification Code" if present
-            send_code_selectors = [
-                'button:has-text("Send Verification Code")',
-                'button:has-text("Send Code")',
-                'button:has-text("Send OTP")',
-                'button:has-text("Get Code")',
-                'a:has-text("Send Verification Code")',
-            ]
+                # Click "Send Verification Code" if present
+                found = await find_first_visible(page, MMI_SEND_CODE_SELECTORS)
+                if found:
+                    selector, send_button = found
+                    logger.info(f"[MMI] Clicking send code button: {selector}")
+                    try:
+                        async with page.expect_response(lambda r: "mmi.run" in r.url and r.request.method == "POST", timeout=10000):
+                            await send_button.click(timeout=10000)
+                        logger.info("[MMI] Verification code sent")
+                    except PlaywrightTimeoutError:
+                        logger.warning("[MMI] No response seen after send code click")
+                    except Exception as e:
+                        logger.warning(f"[MMI] Send button {selector} failed: {e}")
 
-            for selector in send_code_selectors:
-                try:
-                    btn = await page.query_selector(selector)
-                    if btn and await btn.is_visible():
-                        print(f"[MMI] Clicking send code button: {selector}", file=sys.stderr)
-                        await btn.click()
-                        await page.wait_for_load_state("networkidle", timeout=10000)
-                        await asyncio.sleep(2)
-                        print("[MMI] Verification code sent", file=sys.stderr)
+                if captured_token:
+                    logger.info("[MMI] Token captured during 2FA send flow")
+                    return await token_success(context, "mmi", captured_token)
+
+                # Try Twilio SMS auto-read for 2FA code
+                logger.info("[MMI] Attempting Twilio SMS auto-read for 2FA...")
+                twilio_code = None
+                # Poll Twilio a few times with short delays
+                for poll in range(6):  # Try for ~30 seconds
+                    await asyncio.sleep(5)
+                    twilio_code = await fetch_latest_2fa_code(since_seconds=60)
+                    if twilio_code:
                         break
-                except Exception as e:
-                    print(f"[MMI] Send button {selector} failed: {e}", file=sys.stderr)
-                    continue
 
-            if captured_token:
-                print("[MMI] Token captured during 2FA send flow", file=sys.stderr)
-                await save_storage_state(context, "mmi")
-                expires_at = int((datetime.now() + timedelta(hours=1, minutes=-5)).timestamp() * 1000)
-                await browser.close()
-                await playwright_instance.stop()
-                return {"success": True, "token": captured_token, "expiresAt": expires_at}
-
-            # Try Twilio SMS auto-read for 2FA code
-            print("[MMI] Attempting Twilio SMS auto-read for 2FA...", file=sys.stderr)
-            twilio_code = None
-            # Poll Twilio a few times with short delays
-            for poll in range(6):  # Try for ~30 seconds
-                await asyncio.sleep(5)
-                twilio_code = fetch_latest_2fa_code(since_seconds=60)
                 if twilio_code:
-                    break
+                    logger.info(f"[MMI] Auto-filling 2FA code from Twilio: {twilio_code}")
+                    # Fill in the 2FA code
+                    twofa_result = await _fill_and_submit_2fa(page, context, twilio_code)
+                    if twofa_result:
+                        await save_storage_state(context, "mmi")
+                        return twofa_result
+
+                # No Twilio code — fall back to manual 2FA session
+                logger.info("[MMI] Storing session for manual 2FA code entry")
+                await detach_browser_session("mmi", context)
+                while len(pending_2fa_sessions) >= MAX_PENDING_2FA_SESSIONS:
+                    await discard_pending_2fa_session(next(iter(pending_2fa_sessions)), "Evicting oldest")
+                handle = next(session_handles)
+                new_session_id = sign_session_handle(handle)
+                pending_session = {
+                    "session_id": new_session_id,
+                    "context": context,
+                    "page": page,
+                    "created_at": datetime.now(),
+                    "captured_token": None,
+                }
+                pending_2fa_sessions[handle] = pending_session
 
-            if twilio_code:
-                print(f"[MMI] Auto-filling 2FA code from Twilio: {twilio_code}", file=sys.stderr)
-                # Fill in the 2FA code
-                twofa_result = await _fill_and_submit_2fa(page, context, twilio_code)
-                if twofa_result:
-                    await save_storage_state(context, "mmi")
-                    await browser.close()
-                    await playwright_instance.stop()
-                    return twofa_result
-
-            # No Twilio code — fall back to manual 2FA session
-            print("[MMI] Storing session for manual 2FA code entry", file=sys.stderr)
-            new_session_id = str(uuid.uuid4())
-            pending_2fa_sessions[new_session_id] = {
-                "playwright": playwright_instance,
-                "browser": browser,
-                "context": context,
-                "page": page,
-                "created_at": datetime.now(),
-                "captured_token": None,
-            }
+                def session_request_handler(request):
+                    if request.resource_type not in API_RESOURCE_TYPES:
+                        return
+                    m = MMI_BEARER_RE.fullmatch(request.headers.get("authorization", ""))
+                    if m and "mmi.run" in request.url:
+                        pending_session["captured_token"] = m.group(1)
 
-            async def session_request_handler(request):
-                auth = request.headers.get("authorization", "")
-                if auth.startswith("Bearer ") and "mmi.run" in request.url:
-                    token = auth.replace("Bearer ", "")
-                    if len(token) > 20:
-                        pending_2fa_sessions[new_session_id]["captured_token"] = token
+                page.on("request", session_request_handler)
+                run["keep_page"] = True
 
-            page.on("request", session_request_handler)
+                return {
+                    "requires_2fa": True,
+                    "session_id": new_session_id,
+                    "message": "2FA verification required. Submit code via /tokens/mmi/2fa",
+                }
 
-            return {
-                "requires_2fa": True,
-                "session_id": new_session_id,
-                "message": "2FA verification required. Submit code via /tokens/mmi/2fa",
-            }
+            # Token not captured yet — navigate to trigger API calls
+            if not captured_token:
+                logger.info("[MMI] Token not captured from login, loading dashboard and property search...")
+                try:
+                    await race_token_pages(context, page, MMI_TOKEN_URLS, is_mmi_token_request, handle_request)
+                except Exception as e:
+                    logger.warning(f"[MMI] Token page navigation failed: {e}")
 
-        # Token not captured yet — navigate to trigger API calls
-        if not captured_token:
-            print("[MMI] Token not captured from login, navigating to dashboard...", file=sys.stderr)
-            try:
-                await page.goto("https://new.mmi.run/dashboard", wait_until="networkidle", timeout=20000)
-                await asyncio.sleep(3)
-            except Exception as e:
-                print(f"[MMI] Dashboard navigation failed: {e}", file=sys.stderr)
+            # Check localStorage/sessionStorage and the api_key cookie
+            if not captured_token:
+                logger.info("[MMI] Checking storage and cookies for token...")
+                captured_token = await find_mmi_stored_token(page, context)
 
-        if not captured_token:
-            print("[MMI] Trying property search page...", file=sys.stderr)
-            try:
-                await page.goto("https://new.mmi.run/property-search", wait_until="networkidle", timeout=20000)
-                await asyncio.sleep(3)
-            except Exception as e:
-                print(f"[MMI] Property search navigation failed: {e}", file=sys.stderr)
-
-        # Check localStorage/sessionStorage
-        if not captured_token:
-            print("[MMI] Checking storage for token...", file=sys.stderr)
-            token_from_storage = await page.evaluate("""
-                () => {
-                    const keys = ['token', 'accessToken', 'access_token', 'jwt', 'bearerToken', 'authToken', 'api_key'];
-                    for (const key of keys) {
-                        let t = localStorage.getItem(key) || sessionStorage.getItem(key);
-                        if (t && t.length > 20) return t;
-                    }
-                    for (let i = 0; i < localStorage.length; i++) {
-                        const key = localStorage.key(i);
-                        const val = localStorage.getItem(key);
-                        if (val && val.startsWith('eyJ') && val.length > 50) return val;
-                    }
-                    return null;
-                }
-            """)
-            if token_from_storage:
-                captured_token = token_from_storage
-                print("[MMI] Found token in storage", file=sys.stderr)
-
-        # Check cookies
-        if not captured_token:
-            print("[MMI] Checking cookies for api_key...", file=sys.stderr)
-            cookies = await context.cookies()
-            api_key_cookie = next((c for c in cookies if c["name"] == "api_key"), None)
-            if api_key_cookie:
-                captured_token = unquote(api_key_cookie["value"])
-                print("[MMI] Found api_key cookie", file=sys.stderr)
-
-        if not captured_token:
-            print(f"[MMI] Could not capture token. Final URL: {page.url}", file=sys.stderr)
-            await browser.close()
-            await playwright_instance.stop()
-            return {"error": f"Could not capture token. URL: {page.url}"}
-
-        # Save storage state for next time (persistent session / trusted device)
-        await save_storage_state(context, "mmi")
-
-        expires_at = int((datetime.now() + timedelta(hours=1, minutes=-5)).timestamp() * 1000)
-        print("[MMI] Token extracted successfully", file=sys.stderr)
-        await browser.close()
-        await playwright_instance.stop()
-        return {"success": True, "token": captured_token, "expiresAt": expires_at}
+            if not captured_token:
+                final_url = page.url
+                logger.warning(f"[MMI] Could not capture token. Final URL: {final_url}")
+                await close_browser_session("mmi")
+                return {"error": f"Could not capture token. URL: {final_url}"}
+
+            # Storage state is saved for next time (persistent session / trusted device)
+            logger.info("[MMI] Token extracted successfully")
+            return await token_success(context, "mmi", captured_token)
 
     except Exception as e:
-        traceback.print_exc()
-        if browser:
-            try:
-                await browser.close()
-            except:
-                pass
-        if playwright_instance:
-            try:
-                await playwright_instance.stop()
-            except:
-                pass
+        logger.exception("[MMI] Extraction failed")
         return {"error": f"MMI extraction failed: {str(e)}"}
 
 
@@ -641,181 +1193,191 @@ async def _fill_and_submit_2fa(page, context, code):
     """Fill 2FA code and submit, return token result or None."""
     captured_token = None
 
-    async def capture_handler(request):
+    def capture_handler(request):
         nonlocal captured_token
-        auth = request.headers.get("authorization", "")
-        if auth.startswith("Bearer ") and "mmi.run" in request.url:
-            token = auth.replace("Bearer ", "")
-            if len(token) > 20:
-                captured_token = token
+        if request.resource_type not in API_RESOURCE_TYPES:
+            return
+        m = MMI_BEARER_RE.fullmatch(request.headers.get("authorization", ""))
+        if m and "mmi.run" in request.url:
+            captured_token = m.group(1)
 
     page.on("request", capture_handler)
 
-    twofa_selectors = [
-        'input[name="code"]', 'input[name="otp"]', 'input[name="totp"]',
-        'input[name="2fa"]', 'input[name="mfaCode"]', 'input[name="mfa_code"]',
-        'input[name="verificationCode"]', 'input[name="verification_code"]',
-        'input[name="twoFactorCode"]',
-        'input[placeholder*="code" i]', 'input[placeholder*="verification" i]',
-        'input[placeholder*="digit" i]',
-        'input[aria-label*="code" i]', 'input[aria-label*="verification" i]',
-        'input[type="tel"][maxlength="6"]', 'input[type="tel"][maxlength="1"]',
-        'input[autocomplete="one-time-code"]',
-        'input[inputmode="numeric"][maxlength="6"]',
-        'input.otp-input', 'input.code-input',
-    ]
-
-    filled = False
-    for selector in twofa_selectors:
-        try:
-            el = await page.query_selector(selector)
-            if el and await el.is_visible():
-                input_type = await el.get_attribute("type")
-                input_name = await el.get_attribute("name") or ""
-                if input_type in ["email", "password"] or "email" in input_name.lower() or "password" in input_name.lower():
-                    continue
-                await el.fill(code)
-                print(f"[MMI-2FA] Filled code with selector: {selector}", file=sys.stderr)
-                filled = True
-                break
-        except:
-            continue
+    filled = None
+    try:
+        filled = await page.evaluate(TWOFA_INPUT_JS, {"selector": TWOFA_SELECTOR, "code": code})
+    except Exception as e:
+        logger.warning(f"[MMI-2FA] Input fill failed: {e}")
 
-    if not filled:
-        try:
-            digit_inputs = await page.query_selector_all('input[maxlength="1"]')
-            visible_inputs = []
-            for inp in digit_inputs:
-                if await inp.is_visible():
-                    inp_type = await inp.get_attribute("type")
-                    if inp_type not in ["email", "password"]:
-                        visible_inputs.append(inp)
-            if len(visible_inputs) >= 4 and len(code) >= len(visible_inputs):
-                for i, inp in enumerate(visible_inputs):
-                    await inp.fill(code[i])
-                filled = True
-        except:
-            pass
+    if filled and filled["input"]:
+        logger.info(f"[MMI-2FA] Filled code into {filled['input']}")
+    elif filled:
+        logger.info(f"[MMI-2FA] Filled code across {filled['digits']} digit inputs")
 
     if not filled:
-        print("[MMI-2FA] Could not find 2FA input field", file=sys.stderr)
+        logger.warning("[MMI-2FA] Could not find 2FA input field")
         return None
 
-    # Submit
-    submit_selectors = [
-        'button[type="submit"]', 'button:has-text("Verify")',
-        'button:has-text("Submit")', 'button:has-text("Continue")',
-        'button:has-text("Confirm")', 'input[type="submit"]',
-    ]
-
-    submitted = False
-    for selector in submit_selectors:
-        try:
-            btn = await page.query_selector(selector)
-            if btn and await btn.is_visible():
-                await btn.click()
-                submitted = True
-                break
-        except:
-            continue
+    # Accepted codes lead to an authenticated API call or a redirect away from
+    # the verification URL; rejected ones leave the page as it was. Read the URL
+    # before submitting, since the redirect can land while the click returns.
+    verify_url = page.url
 
-    if not submitted:
+    # Submit
+    if not await click_first_present(page, TWOFA_SUBMIT_SELECTORS):
         await page.keyboard.press("Enter")
 
-    await page.wait_for_load_state("networkidle", timeout=30000)
-    await asyncio.sleep(3)
+    # capture_handler already saw any token request fired during the submit
+    if not captured_token and page.url == verify_url:
+        await wait_for_any(
+            page.wait_for_event("request", predicate=is_mmi_token_request, timeout=30000),
+            page.wait_for_url(lambda url: url != verify_url, wait_until="commit", timeout=30000),
+        )
+    await page.wait_for_load_state("domcontentloaded")
 
-    # Check if 2FA was accepted
-    if await detect_2fa_challenge(page):
-        print("[MMI-2FA] Code was not accepted", file=sys.stderr)
+    # A captured token proves the code was accepted; the SPA may still be on
+    # the verification URL (or showing the code input) when it fires, so only
+    # check for a repeated challenge when no token was seen
+    if not captured_token and await detect_2fa_challenge(page):
+        logger.warning("[MMI-2FA] Code was not accepted")
         return None
 
     # Try to capture token from post-2FA navigation
     if not captured_token:
         try:
-            await page.goto("https://new.mmi.run/dashboard", wait_until="networkidle", timeout=20000)
-            await asyncio.sleep(3)
-        except:
+            await race_token_pages(context, page, MMI_TOKEN_URLS, is_mmi_token_request, capture_handler)
+        except Exception:
             pass
 
     if not captured_token:
-        # Check storage
-        token_from_storage = await page.evaluate("""
-            () => {
-                const keys = ['token', 'accessToken', 'access_token', 'jwt', 'bearerToken', 'authToken', 'api_key'];
-                for (const key of keys) {
-                    let t = localStorage.getItem(key) || sessionStorage.getItem(key);
-                    if (t && t.length > 20) return t;
-                }
-                for (let i = 0; i < localStorage.length; i++) {
-                    const key = localStorage.key(i);
-                    const val = localStorage.getItem(key);
-                    if (val && val.startsWith('eyJ') && val.length > 50) return val;
-                }
-                return null;
-            }
-        """)
-        if token_from_storage:
-            captured_token = token_from_storage
-
-    if not captured_token:
-        cookies = await context.cookies()
-        api_key_cookie = next((c for c in cookies if c["name"] == "api_key"), None)
-        if api_key_cookie:
-            captured_token = unquote(api_key_cookie["value"])
+        captured_token = await find_mmi_stored_token(page, context)
 
     if not captured_token:
         return None
 
-    expires_at = int((datetime.now() + timedelta(hours=1, minutes=-5)).timestamp() * 1000)
-    print("[MMI-2FA] Token extracted after 2FA", file=sys.stderr)
-    return {"success": True, "token": captured_token, "expiresAt": expires_at}
+    logger.info("[MMI-2FA] Token extracted after 2FA")
+    return {"success": True, "token": captured_token, "expiresAt": token_expiry_ms()}
+
+
+def sign_session_handle(handle):
+    """Client-facing session id: the integer handle plus a truncated HMAC so ids can't be guessed."""
+    sig = hmac.new(SERVICE_SECRET.encode(), str(handle).encode(), "sha256").hexdigest()[:16]
+    return f"{handle}.{sig}"
+
+
+def parse_session_id(session_id):
+    """Return the integer handle for a session id, or None if it is malformed or not signed by us."""
+    session_id = str(session_id)
+    handle, _, _ = session_id.partition(".")
+    if not (handle.isascii() and handle.isdigit()):
+        return None
+    if not hmac.compare_digest(sign_session_handle(int(handle)).encode(), session_id.encode()):
+        return None
+    return int(handle)
 
 
 async def complete_2fa_session(session_id: str, twofa_code: str):
     """Complete a pending 2FA session by submitting the verification code"""
     global pending_2fa_sessions
 
-    if session_id not in pending_2fa_sessions:
+    # Claim the session so the reaper (or a duplicate submit) can't touch it
+    handle = parse_session_id(session_id)
+    session = pending_2fa_sessions.pop(handle, None) if handle is not None else None
+    if not session:
         return {"error": "2FA session not found or expired"}
 
-    session = pending_2fa_sessions[session_id]
     page = session["page"]
-    browser = session["browser"]
     context = session["context"]
-    playwright_instance = session["playwright"]
 
     try:
         result = await _fill_and_submit_2fa(page, context, twofa_code)
 
-        # Cleanup session
-        del pending_2fa_sessions[session_id]
-
         if result and result.get("success"):
             await save_storage_state(context, "mmi")
-            await browser.close()
-            await playwright_instance.stop()
             return result
 
-        await browser.close()
-        await playwright_instance.stop()
         return result or {"error": "2FA completed but could not capture token"}
 
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("[MMI-2FA] 2FA completion failed")
+        return {"error": f"2FA completion failed: {str(e)}"}
+
+    finally:
+        # The session's context is its own; the cached "mmi" context (and any
+        # other pending session) is untouched. The next refresh starts from
+        # the storage state saved above.
         try:
-            del pending_2fa_sessions[session_id]
-            await browser.close()
-            await playwright_instance.stop()
-        except:
+            await context.close()
+        except Exception:
             pass
-        return {"error": f"2FA completion failed: {str(e)}"}
+
+
+async def discard_pending_2fa_session(handle, reason):
+    """Drop a pending 2FA session and close its context."""
+    session = pending_2fa_sessions.pop(handle, None)
+    if not session:
+        return
+    logger.info(f"[MMI-2FA] {reason} 2FA session {session['session_id']}")
+    try:
+        await session["context"].close()
+    except Exception:
+        pass
+
+
+async def reap_pending_2fa_sessions():
+    """Background task that closes 2FA sessions nobody submitted a code for,
+    so abandoned prompts don't keep contexts open indefinitely."""
+    while True:
+        try:
+            await asyncio.sleep(PENDING_2FA_REAP_INTERVAL)
+
+            # Sessions are stored in creation order, so stop at the first live one
+            cutoff = datetime.now() - timedelta(seconds=PENDING_2FA_TTL_SECONDS)
+            for handle, session in list(pending_2fa_sessions.items()):
+                if session["created_at"] > cutoff:
+                    break
+                await discard_pending_2fa_session(handle, "Expiring abandoned")
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[MMI-2FA] Reaper error: {e}")
 
 
 # =============================================================================
 # RPR TOKEN EXTRACTION
 # =============================================================================
 
+# Type credentials key by key (50ms apart) instead of filling them instantly
+RPR_HUMAN_TYPING = os.environ.get("RPR_HUMAN_TYPING", "") == "1"
+
+# Every alternative targets the same element, so they resolve as one locator
+RPR_LOGIN_LINK_LOCATOR = 'a[href*="login"], button:has-text("Log In"), a:has-text("Log In"), a:has-text("Sign In")'
+RPR_EMAIL_LOCATOR = 'input[type="email"], input[name="email"], input[id*="email"], input[placeholder*="email" i]'
+
+# Button candidates, tried in order
+RPR_NEXT_SELECTORS = (
+    'button:has-text("Next")', 'button:has-text("Continue")',
+    'button[type="submit"]', 'input[type="submit"]',
+    'button:has-text("Sign In")',
+)
+
+RPR_SUBMIT_SELECTORS = (
+    'button:has-text("Sign In")', 'button:has-text("Log In")',
+    'button[type="submit"]', 'input[type="submit"]',
+)
+
+
+async def enter_rpr_field(page, field, text):
+    """Put text into an RPR login field, typing it out only when RPR_HUMAN_TYPING is set."""
+    await field.click()
+    if RPR_HUMAN_TYPING:
+        await field.fill("")
+        await page.keyboard.type(text, delay=50)
+    else:
+        await field.fill(text)
+
+
 async def extract_rpr_token():
     """Extract Bearer token from RPR login via NAR SSO. Uses persistent sessions."""
     if not PLAYWRIGHT_AVAILABLE:
@@ -829,157 +1391,91 @@ async def extract_rpr_token():
 
     captured_token = None
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(
-            headless=True,
-            args=["--no-sandbox", "--disable-setuid-sandbox", "--disable-dev-shm-usage"]
-        )
-
-        context = await create_context_with_state(browser, "rpr")
-        page = await context.new_page()
+    try:
+        async with provider_page("rpr") as run:
+            context, page = run["context"], run["page"]
 
-        async def handle_request(request):
-            nonlocal captured_token
-            auth = request.headers.get("authorization", "")
-            if auth.startswith("Bearer ") and ("narrpr.com" in request.url or "rpr" in request.url.lower()):
-                captured_token = auth.replace("Bearer ", "")
-                print(f"[RPR] Captured token from {request.url}", file=sys.stderr)
+            def handle_request(request):
+                nonlocal captured_token
+                if request.resource_type not in API_RESOURCE_TYPES:
+                    return
+                m = BEARER_RE.fullmatch(request.headers.get("authorization", ""))
+                if m and ("narrpr.com" in request.url or "rpr" in request.url.lower()):
+                    captured_token = m.group(1)
+                    logger.debug(f"[RPR] Captured token from {request.url}")
 
-        page.on("request", handle_request)
+            page.on("request", handle_request)
 
-        try:
             # Check if already authenticated
-            if await check_already_authenticated(page, "rpr"):
-                await asyncio.sleep(2)
-                if captured_token:
-                    await save_storage_state(context, "rpr")
-                    expires_at = int((datetime.now() + timedelta(hours=1, minutes=-5)).timestamp() * 1000)
-                    return {"success": True, "token": captured_token, "expiresAt": expires_at}
-
-                # Navigate to trigger API calls
-                try:
-                    await page.goto("https://www.narrpr.com/search", wait_until="domcontentloaded", timeout=20000)
-                    await asyncio.sleep(3)
-                except:
-                    pass
-
-                if captured_token:
-                    await save_storage_state(context, "rpr")
-                    expires_at = int((datetime.now() + timedelta(hours=1, minutes=-5)).timestamp() * 1000)
-                    return {"success": True, "token": captured_token, "expiresAt": expires_at}
+            result = await resume_authenticated_session(page, context, "rpr", lambda: captured_token)
+            if result:
+                return result
 
             # Full login flow
-            print("[RPR] Navigating to RPR login...", file=sys.stderr)
-            await page.goto("https://www.narrpr.com/home", wait_until="domcontentloaded", timeout=30000)
-            print(f"[RPR] Current URL: {page.url}", file=sys.stderr)
+            logger.info("[RPR] Navigating to RPR login...")
+            await page.goto(PROVIDERS["rpr"]["home_url"], wait_until="domcontentloaded", timeout=30000)
+            logger.debug(f"[RPR] Current URL: {page.url}")
 
             # Check if we need to click login button
             if "narrpr.com" in page.url and "login" not in page.url.lower():
-                login_btn = await page.query_selector('a[href*="login"], button:has-text("Log In"), a:has-text("Log In"), a:has-text("Sign In")')
-                if login_btn:
-                    print("[RPR] Clicking login button...", file=sys.stderr)
-                    await login_btn.click()
+                found = await find_first_visible(page, (RPR_LOGIN_LINK_LOCATOR,))
+                if found:
+                    logger.info("[RPR] Clicking login button...")
+                    await found[1].click(timeout=10000)
                     await page.wait_for_load_state("domcontentloaded", timeout=30000)
 
             # Wait for email input
-            print("[RPR] Waiting for email input...", file=sys.stderr)
-            await page.wait_for_selector('input[type="email"], input[name="email"], input[id*="email"], input[placeholder*="email" i]', timeout=20000)
-
-            print("[RPR] Entering email...", file=sys.stderr)
-            email_selectors = ['input[type="email"]', 'input[name="email"]', 'input[id*="email"]', 'input[placeholder*="email" i]']
-            for selector in email_selectors:
-                email_input = await page.query_selector(selector)
-                if email_input:
-                    await email_input.click()
-                    await email_input.fill("")
-                    await page.keyboard.type(email, delay=50)
-                    break
+            logger.info("[RPR] Waiting for email input...")
+            email_input = page.locator(RPR_EMAIL_LOCATOR).first
+            await email_input.wait_for(state="visible", timeout=20000)
 
-            await asyncio.sleep(1)
+            logger.info("[RPR] Entering email...")
+            await enter_rpr_field(page, email_input, email)
 
-            next_selectors = [
-                'button:has-text("Next")', 'button:has-text("Continue")',
-                'button[type="submit"]', 'input[type="submit"]',
-                'button:has-text("Sign In")',
-            ]
+            # The click waits for the button to enable, so no settle delay is needed
+            await click_first_present(page, RPR_NEXT_SELECTORS)
 
-            for selector in next_selectors:
-                try:
-                    btn = await page.query_selector(selector)
-                    if btn:
-                        for _ in range(20):
-                            is_disabled = await btn.get_attribute("disabled")
-                            if not is_disabled:
-                                break
-                            await asyncio.sleep(0.5)
-                        await btn.click()
-                        break
-                except:
-                    continue
-
-            await asyncio.sleep(2)
+            # Two-step SSO reveals the password field after Next
+            password_input = page.locator('input[type="password"]').first
+            try:
+                await password_input.wait_for(state="visible", timeout=10000)
+            except PlaywrightTimeoutError:
+                password_input = None
 
-            password_input = await page.query_selector('input[type="password"]')
             if password_input:
-                print("[RPR] Entering password...", file=sys.stderr)
-                await password_input.click()
-                await password_input.fill("")
-                await page.keyboard.type(password, delay=50)
-                await asyncio.sleep(1)
-
-                submit_selectors = [
-                    'button:has-text("Sign In")', 'button:has-text("Log In")',
-                    'button[type="submit"]', 'input[type="submit"]',
-                ]
-
-                for selector in submit_selectors:
-                    try:
-                        btn = await page.query_selector(selector)
-                        if btn:
-                            for _ in range(20):
-                                is_disabled = await btn.get_attribute("disabled")
-                                if not is_disabled:
-                                    break
-                                await asyncio.sleep(0.5)
-                            await btn.click()
-                            break
-                    except:
-                        continue
+                logger.info("[RPR] Entering password...")
+                await enter_rpr_field(page, password_input, password)
+
+                await click_first_present(page, RPR_SUBMIT_SELECTORS)
             else:
                 await page.keyboard.press("Enter")
 
-            print("[RPR] Waiting for login completion...", file=sys.stderr)
+            logger.info("[RPR] Waiting for login completion...")
+            # Done once SSO hands us back to narrpr.com or the app makes an authenticated call
+            await wait_for_any(
+                page.wait_for_url(lambda url: not is_rpr_login_url(url), wait_until="commit", timeout=30000),
+                page.wait_for_event("request", predicate=is_rpr_token_request, timeout=30000),
+            )
             await page.wait_for_load_state("domcontentloaded", timeout=30000)
-            await asyncio.sleep(5)
+            if not captured_token:
+                # Short grace for the landing page's first API call
+                await wait_for_any(page.wait_for_event("request", predicate=is_rpr_token_request, timeout=5000))
 
-            print(f"[RPR] Final URL: {page.url}", file=sys.stderr)
+            logger.info(f"[RPR] Final URL: {page.url}")
 
             if not captured_token:
                 try:
-                    await page.goto("https://www.narrpr.com/search", wait_until="domcontentloaded", timeout=20000)
-                    await asyncio.sleep(3)
-                except:
+                    await goto_and_wait_for_token(page, PROVIDERS["rpr"]["token_page_url"], is_rpr_token_request)
+                except Exception:
                     pass
 
             if not captured_token:
-                token_from_storage = await page.evaluate("""
-                    () => {
-                        const keys = ['token', 'accessToken', 'access_token', 'jwt', 'bearerToken', 'authToken'];
-                        for (const key of keys) {
-                            let t = localStorage.getItem(key) || sessionStorage.getItem(key);
-                            if (t && t.length > 20) return t;
-                        }
-                        for (let i = 0; i < localStorage.length; i++) {
-                            const key = localStorage.key(i);
-                            const val = localStorage.getItem(key);
-                            if (val && val.startsWith('eyJ') && val.length > 50) return val;
-                        }
-                        return null;
-                    }
-                """)
-                if token_from_storage:
-                    captured_token = token_from_storage
+                found = await page.evaluate(STORED_TOKEN_JS)
+                if found:
+                    captured_token = found["token"]
+                    logger.info(f"[RPR] Found token in {found['source']}")
 
+            # HttpOnly cookies never show up in document.cookie
             if not captured_token:
                 cookies = await context.cookies()
                 for cookie in cookies:
@@ -989,78 +1485,116 @@ async def extract_rpr_token():
                             break
 
             if not captured_token:
-                return {"error": f"Could not capture token. URL: {page.url}"}
+                final_url = page.url
+                await close_browser_session("rpr")
+                return {"error": f"Could not capture token. URL: {final_url}"}
 
-            # Save persistent session
-            await save_storage_state(context, "rpr")
+            logger.info("[RPR] Token extracted successfully")
+            return await token_success(context, "rpr", captured_token)
 
-            expires_at = int((datetime.now() + timedelta(hours=1, minutes=-5)).timestamp() * 1000)
-            print("[RPR] Token extracted successfully", file=sys.stderr)
-            return {"success": True, "token": captured_token, "expiresAt": expires_at}
-
-        except Exception as e:
-            traceback.print_exc()
-            return {"error": f"RPR extraction failed: {str(e)}"}
-        finally:
-            await browser.close()
+    except Exception as e:
+        logger.exception("[RPR] Extraction failed")
+        return {"error": f"RPR extraction failed: {str(e)}"}
 
 
 # =============================================================================
 # TOKEN MANAGEMENT WITH RETRY
 # =============================================================================
 
-def refresh_token(provider):
+def save_token_cache():
+    """Write current tokens to disk (owner-only, replaced atomically)."""
+    data = {
+        provider: {"token": td.token, "expiresAt": td.expires_at, "lastRefresh": td.last_refresh}
+        for provider, td in tokens.items()
+        if td.token
+    }
+    tmp_path = TOKEN_CACHE_PATH.with_name(TOKEN_CACHE_PATH.name + ".tmp")
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, TOKEN_CACHE_PATH)
+    except Exception as e:
+        logger.warning(f"[TokenService] Failed to save token cache: {e}")
+
+
+def load_token_cache():
+    """Restore cached tokens that have not expired yet."""
+    try:
+        data = json.loads(TOKEN_CACHE_PATH.read_text())
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.warning(f"[TokenService] Failed to load token cache: {e}")
+        return
+
+    now_ms = int(time.time() * 1000)
+    for provider, cached in data.items():
+        if provider in tokens and cached.get("token") and cached.get("expiresAt", 0) > now_ms:
+            update_token_state(
+                provider,
+                token=cached["token"],
+                expires_at=cached["expiresAt"],
+                last_refresh=cached.get("lastRefresh"),
+            )
+            logger.info(f"[TokenService] Restored cached {provider} token")
+
+
+def update_token_state(provider, **changes):
+    """Publish an updated copy of a provider's (frozen) token entry."""
+    tokens[provider] = replace(tokens[provider], **changes)
+
+
+async def refresh_token(provider):
     """Refresh a specific token with retry and exponential backoff."""
     global tokens
 
-    delays = [5, 15, 45]  # seconds between retries
+    delays = REFRESH_RETRY_DELAYS
 
     for attempt in range(len(delays)):
-        print(f"[TokenService] Refreshing {provider} token (attempt {attempt + 1}/{len(delays)})...", file=sys.stderr)
+        logger.info(f"[TokenService] Refreshing {provider} token (attempt {attempt + 1}/{len(delays)})...")
 
         try:
             if provider == "mmi":
-                result = asyncio.run(extract_mmi_token())
+                async with extract_semaphores["mmi"]:
+                    result = await extract_mmi_token()
             elif provider == "rpr":
-                result = asyncio.run(extract_rpr_token())
+                async with extract_semaphores["rpr"]:
+                    result = await extract_rpr_token()
             else:
                 return {"error": f"Unknown provider: {provider}"}
 
-            with token_lock:
+            async with token_locks[provider]:
                 if result.get("success"):
-                    tokens[provider] = {
-                        "token": result["token"],
-                        "expiresAt": result["expiresAt"],
-                        "lastError": None,
-                        "lastRefresh": datetime.now().isoformat(),
-                        "retryCount": 0,
-                    }
-                    print(f"[TokenService] {provider} token refreshed successfully", file=sys.stderr)
+                    tokens[provider] = TokenEntry(
+                        token=result["token"],
+                        expires_at=result["expiresAt"],
+                        last_refresh=datetime.now().isoformat(),
+                    )
+                    save_token_cache()
+                    logger.info(f"[TokenService] {provider} token refreshed successfully")
                     return result
                 elif result.get("requires_2fa"):
                     # 2FA pending — don't retry, return immediately
-                    tokens[provider]["lastError"] = "Waiting for 2FA"
+                    update_token_state(provider, last_error="Waiting for 2FA")
                     return result
                 else:
-                    tokens[provider]["lastError"] = result.get("error")
-                    tokens[provider]["retryCount"] = attempt + 1
-                    print(f"[TokenService] {provider} token refresh failed: {result.get('error')}", file=sys.stderr)
+                    update_token_state(provider, last_error=result.get("error"), retry_count=attempt + 1)
+                    logger.warning(f"[TokenService] {provider} token refresh failed: {result.get('error')}")
 
         except Exception as e:
             error_msg = f"Exception: {str(e)}"
-            with token_lock:
-                tokens[provider]["lastError"] = error_msg
-                tokens[provider]["retryCount"] = attempt + 1
-            print(f"[TokenService] {provider} exception: {error_msg}", file=sys.stderr)
-            traceback.print_exc()
+            async with token_locks[provider]:
+                update_token_state(provider, last_error=error_msg, retry_count=attempt + 1)
+            logger.exception(f"[TokenService] {provider} exception: {error_msg}")
 
         if attempt < len(delays) - 1:
-            print(f"[TokenService] Retrying {provider} in {delays[attempt]}s...", file=sys.stderr)
-            time.sleep(delays[attempt])
+            logger.warning(f"[TokenService] Retrying {provider} in {delays[attempt]}s...")
+            await asyncio.sleep(delays[attempt])
 
     # All retries failed — send alert email
-    error_msg = tokens[provider].get("lastError", "Unknown error")
-    send_alert_email(
+    error_msg = tokens[provider].last_error or "Unknown error"
+    await send_alert_email(
         f"[TCDS Token Service] {provider.upper()} token refresh FAILED",
         f"All {len(delays)} attempts to refresh the {provider.upper()} token have failed.\n\n"
         f"Last error: {error_msg}\n"
@@ -1072,25 +1606,80 @@ def refresh_token(provider):
     return {"error": f"All {len(delays)} refresh attempts failed. Last error: {error_msg}"}
 
 
-def get_token(provider):
-    """Get a valid token, refreshing if needed."""
-    with token_lock:
-        token_data = tokens.get(provider)
-        if not token_data:
-            return {"error": f"Unknown provider: {provider}"}
+def record_refresh_outcome(provider, task):
+    """Done-callback for refresh tasks: reset the provider's backoff on success,
+    otherwise push its next background refresh out exponentially."""
+    if task.cancelled():
+        return
+    result = None if task.exception() else task.result()
+    if isinstance(result, dict) and result.get("success"):
+        refresh_failures[provider] = 0
+        refresh_retry_at[provider] = 0.0
+        return
+    refresh_failures[provider] += 1
+    backoff = min(PROACTIVE_BACKOFF_MAX, PROACTIVE_CHECK_INTERVAL * 2 ** refresh_failures[provider])
+    refresh_retry_at[provider] = time.monotonic() + backoff
+    logger.warning(
+        f"[TokenService] {provider.upper()} refresh failed {refresh_failures[provider]}x, "
+        f"next background attempt in {backoff}s"
+    )
 
-        now_ms = int(time.time() * 1000)
-        buffer_ms = REFRESH_BUFFER_SECONDS * 1000
-
-        if token_data["token"] and token_data["expiresAt"] > (now_ms + buffer_ms):
-            return {
-                "success": True,
-                "token": token_data["token"],
-                "expiresAt": token_data["expiresAt"],
-                "cached": True,
-            }
 
-    result = refresh_token(provider)
+def background_refresh_allowed(provider):
+    """Whether a refresh nobody is waiting on may start now: not inside the
+    failure backoff, and for MMI not while a 2FA prompt awaits its code."""
+    if provider == "mmi" and pending_2fa_sessions:
+        return False
+    return time.monotonic() >= refresh_retry_at[provider]
+
+
+def start_refresh(provider):
+    """Return the provider's running refresh task, starting one if none is running.
+    Callers await it through asyncio.shield so one client disconnecting doesn't
+    cancel the refresh the others are waiting on."""
+    task = refresh_tasks[provider]
+    if task is None or task.done():
+        task = asyncio.create_task(refresh_token(provider), name=f"refresh_{provider}")
+        task.add_done_callback(lambda t: record_refresh_outcome(provider, t))
+        refresh_tasks[provider] = task
+    return task
+
+
+def get_cached_token(provider, buffer_ms=REFRESH_BUFFER_SECONDS * 1000):
+    """Return the cached token response if it is valid for at least buffer_ms, else None.
+    Lock-free: entries are replaced whole on write, so one read sees a consistent state."""
+    token_data = tokens[provider]
+
+    now_ms = int(time.time() * 1000)
+
+    if token_data.token and token_data.expires_at > (now_ms + buffer_ms):
+        return {
+            "success": True,
+            "token": token_data.token,
+            "expiresAt": token_data.expires_at,
+            "cached": True,
+        }
+    return None
+
+
+async def get_token(provider):
+    """Get a valid token. A token inside the refresh buffer is still served and
+    refreshed in the background; callers only wait when it is missing or expired."""
+    if provider not in tokens:
+        return {"error": f"Unknown provider: {provider}"}
+
+    cached = get_cached_token(provider)
+    if cached:
+        return cached
+
+    stale = get_cached_token(provider, buffer_ms=0)
+    if stale:
+        if background_refresh_allowed(provider):
+            start_refresh(provider)
+        return stale
+
+    result = await asyncio.shield(start_refresh(provider))
+
     if result.get("success"):
         return {
             "success": True,
@@ -1105,202 +1694,308 @@ def get_token(provider):
 # PROACTIVE TOKEN REFRESH DAEMON
 # =============================================================================
 
-def proactive_refresh_daemon():
-    """Background thread that proactively refreshes tokens before expiry."""
-    print("[Daemon] Proactive token refresh daemon started", file=sys.stderr)
+async def proactive_refresh_daemon():
+    """Background task that proactively refreshes tokens before expiry."""
+    logger.info("[Daemon] Proactive token refresh daemon started")
 
     while True:
         try:
-            time.sleep(PROACTIVE_CHECK_INTERVAL)
-
-            now_ms = int(time.time() * 1000)
-            buffer_ms = REFRESH_BUFFER_SECONDS * 1000
+            # Refresh ahead of the request-path buffer so callers never see a
+            # stale cache and have to wait on the browser themselves
+            due_ms = (REFRESH_BUFFER_SECONDS + PROACTIVE_REFRESH_MARGIN) * 1000
+            due = []
 
             for provider in ["rpr", "mmi"]:
-                with token_lock:
-                    token_data = tokens[provider]
-                    has_token = bool(token_data["token"])
-                    expires_at = token_data["expiresAt"]
-
-                if has_token and expires_at > 0:
+                # Failed refreshes back off exponentially (see record_refresh_outcome)
+                if not background_refresh_allowed(provider):
+                    continue
+                now_ms = int(time.time() * 1000)
+                token_data = tokens[provider]
+                has_token = bool(token_data.token)
+                expires_at = token_data.expires_at
+
+                if not has_token:
+                    # Nothing cached (never fetched, or the last fetch failed):
+                    # fetch it now so the next caller doesn't pay for the browser login
+                    logger.info(f"[Daemon] No {provider.upper()} token, fetching...")
+                    due.append(provider)
+                elif has_token and expires_at > 0:
                     remaining_ms = expires_at - now_ms
                     remaining_min = remaining_ms / 60000
 
-                    if remaining_ms <= buffer_ms:
-                        print(f"[Daemon] {provider.upper()} token expiring in {remaining_min:.1f} min, refreshing...", file=sys.stderr)
-                        refresh_token(provider)
+                    if remaining_ms <= due_ms:
+                        logger.info(f"[Daemon] {provider.upper()} token expiring in {remaining_min:.1f} min, refreshing...")
+                        due.append(provider)
                     else:
-                        print(f"[Daemon] {provider.upper()} token OK, {remaining_min:.1f} min remaining", file=sys.stderr)
+                        logger.debug(f"[Daemon] {provider.upper()} token OK, {remaining_min:.1f} min remaining")
 
+            # Providers log in on separate contexts, so their refreshes overlap
+            await asyncio.gather(
+                *(asyncio.shield(start_refresh(provider)) for provider in due),
+                return_exceptions=True,
+            )
+
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"[Daemon] Error: {e}", file=sys.stderr)
-            traceback.print_exc()
+            logger.exception(f"[Daemon] Error: {e}")
+
+        await asyncio.sleep(PROACTIVE_CHECK_INTERVAL)
 
 
 # =============================================================================
 # HTTP SERVER
 # =============================================================================
 
-class TokenHandler(BaseHTTPRequestHandler):
-    """HTTP request handler for token service."""
+PUBLIC_PATHS = {"/health"}
 
-    def log_message(self, format, *args):
-        print(f"[HTTP] {args[0]}", file=sys.stderr)
+EXPECTED_AUTH_HEADER = f"Bearer {SERVICE_SECRET}".encode()
 
-    def send_json(self, data, status=200):
-        self.send_response(status)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+CORS_PREFLIGHT_HEADERS = {
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Authorization, Content-Type",
+}
 
-    def check_auth(self):
-        auth = self.headers.get("Authorization", "")
-        expected = f"Bearer {SERVICE_SECRET}"
-        if auth != expected:
-            self.send_json({"error": "Unauthorized"}, 401)
-            return False
-        return True
 
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Authorization, Content-Type")
-        self.end_headers()
-
-    def do_GET(self):
-        if self.path == "/health":
-            now_ms = int(time.time() * 1000)
-            uptime_seconds = (datetime.now() - SERVICE_START_TIME).total_seconds()
-
-            def token_info(provider):
-                td = tokens[provider]
-                remaining_ms = td["expiresAt"] - now_ms if td["expiresAt"] > 0 else 0
-                remaining_min = max(0, remaining_ms / 60000)
-                state_path = get_storage_state_path(provider)
-                return {
-                    "hasToken": bool(td["token"]),
-                    "expiresInMinutes": round(remaining_min, 1),
-                    "lastRefresh": td["lastRefresh"],
-                    "lastError": td["lastError"],
-                    "retryCount": td.get("retryCount", 0),
-                    "hasStorageState": state_path.exists(),
-                }
+@web.middleware
+async def http_middleware(request, handler):
+    """Access logging, CORS, auth and JSON error bodies for every route."""
+    if request.method == "OPTIONS":
+        response = web.Response(headers=CORS_PREFLIGHT_HEADERS)
+    elif request.path not in PUBLIC_PATHS and not check_auth(request):
+        response = json_response({"error": "Unauthorized"}, status=401)
+    else:
+        try:
+            response = await handler(request)
+        except (web.HTTPNotFound, web.HTTPMethodNotAllowed):
+            response = json_response({"error": "Not found"}, status=404)
 
-            self.send_json({
-                "status": "ok",
-                "uptime_seconds": round(uptime_seconds),
-                "uptime_human": str(timedelta(seconds=int(uptime_seconds))),
-                "playwright": PLAYWRIGHT_AVAILABLE,
-                "twilio_configured": bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_2FA_PHONE_NUMBER),
-                "email_alerts_configured": bool(OUTLOOK_TENANT_ID and OUTLOOK_CLIENT_ID),
-                "tokens": {
-                    "mmi": token_info("mmi"),
-                    "rpr": token_info("rpr"),
-                },
-                "pending_2fa_sessions": len(pending_2fa_sessions),
-            })
-            return
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    logger.debug(f"[HTTP] {request.method} {request.path_qs} HTTP/{request.version.major}.{request.version.minor}")
+    return response
 
-        if not self.check_auth():
-            return
 
-        if self.path == "/tokens/mmi":
-            result = get_token("mmi")
-            self.send_json(result, 200 if result.get("success") or result.get("requires_2fa") else 500)
-        elif self.path == "/tokens/rpr":
-            result = get_token("rpr")
-            self.send_json(result, 200 if result.get("success") else 500)
-        else:
-            self.send_json({"error": "Not found"}, 404)
-
-    def do_POST(self):
-        if not self.check_auth():
-            return
+# Response/request bodies go through orjson when it is installed; responses
+# are encoded straight to bytes
+def json_dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
 
-        if self.path == "/tokens/refresh":
-            mmi_result = refresh_token("mmi")
-            rpr_result = refresh_token("rpr")
-            self.send_json({
-                "mmi": mmi_result,
-                "rpr": rpr_result,
-            })
-        elif self.path == "/tokens/mmi/2fa":
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length).decode('utf-8')
 
-            try:
-                data = json.loads(body)
-                session_id = data.get("session_id")
-                code = data.get("code")
+def json_loads(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
 
-                if not session_id or not code:
-                    self.send_json({"error": "session_id and code required"}, 400)
-                    return
 
-                result = asyncio.run(extract_mmi_token(session_id=session_id, twofa_code=code))
+def json_response(data, status=200):
+    return web.Response(body=json_dumps(data), status=status, content_type="application/json")
+
+
+def check_auth(request):
+    # Constant-time compare so response timing doesn't leak how much of the secret matched
+    auth = request.headers.get("Authorization", "").encode("utf-8", "surrogatepass")
+    return hmac.compare_digest(auth, EXPECTED_AUTH_HEADER)
+
+
+def health_token_view(provider, now_ms):
+    td = tokens[provider]
+    remaining_ms = td.expires_at - now_ms if td.expires_at > 0 else 0
+    return {
+        "hasToken": bool(td.token),
+        "expiresInMinutes": round(max(0, remaining_ms / 60000), 1),
+        "lastRefresh": td.last_refresh,
+        "lastError": td.last_error,
+        "retryCount": td.retry_count,
+        "hasStorageState": get_storage_state_path(provider).exists(),
+    }
+
+
+def health_etag(views):
+    """Weak ETag over the state /health reports. Uptime and minutes-remaining
+    are derived from the clock, so they are left out on purpose."""
+    parts = [len(pending_2fa_sessions)]
+    for provider, view in views.items():
+        parts += [
+            view["hasToken"], tokens[provider].expires_at, view["lastRefresh"],
+            view["lastError"], view["retryCount"], view["hasStorageState"],
+        ]
+    return f'W/"{hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()}"'
+
+
+# /health snapshot (per-provider views, ETag, serialized body) shared by every probe
+# within the TTL, so a burst of liveness/readiness checks costs one state scan and
+# at most one dump
+HEALTH_CACHE_TTL = 1.0
+health_cache = {"at": float("-inf"), "views": None, "etag": None, "body": None}
+
+# Configuration flags never change while the service runs
+HEALTH_CONFIG = {
+    "playwright": PLAYWRIGHT_AVAILABLE,
+    "twilio_configured": bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_2FA_PHONE_NUMBER),
+    "email_alerts_configured": bool(OUTLOOK_TENANT_ID and OUTLOOK_CLIENT_ID),
+}
 
-                if result.get("success"):
-                    with token_lock:
-                        tokens["mmi"] = {
-                            "token": result["token"],
-                            "expiresAt": result["expiresAt"],
-                            "lastError": None,
-                            "lastRefresh": datetime.now().isoformat(),
-                            "retryCount": 0,
-                        }
-                    self.send_json(result)
-                else:
-                    self.send_json(result, 400 if "error" in result else 200)
-            except json.JSONDecodeError:
-                self.send_json({"error": "Invalid JSON"}, 400)
-            except Exception as e:
-                self.send_json({"error": str(e)}, 500)
-        elif self.path == "/tokens/mmi/2fa/status":
-            pending = list(pending_2fa_sessions.keys())
-            self.send_json({
-                "pending_sessions": len(pending),
-                "session_ids": pending,
-            })
-        else:
-            self.send_json({"error": "Not found"}, 404)
+
+def build_health_body(uptime_seconds, views):
+    return json_dumps({
+        "status": "ok",
+        "uptime_seconds": uptime_seconds,
+        "uptime_human": str(timedelta(seconds=uptime_seconds)),
+        **HEALTH_CONFIG,
+        "tokens": views,
+        "pending_2fa_sessions": len(pending_2fa_sessions),
+    })
+
+
+async def handle_health(request):
+    now = time.monotonic()
+    if now - health_cache["at"] >= HEALTH_CACHE_TTL:
+        now_ms = int(time.time() * 1000)
+        views = {provider: health_token_view(provider, now_ms) for provider in tokens}
+        health_cache["at"] = now
+        health_cache["views"] = views
+        health_cache["etag"] = health_etag(views)
+        health_cache["body"] = None  # built by the first probe that needs it
+
+    etag = health_cache["etag"]
+    if etag in (tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")):
+        return web.Response(status=304, headers={"ETag": etag})
+
+    if health_cache["body"] is None:
+        uptime_seconds = int((datetime.now() - SERVICE_START_TIME).total_seconds())
+        health_cache["body"] = build_health_body(uptime_seconds, health_cache["views"])
+
+    return web.Response(body=health_cache["body"], content_type="application/json", headers={"ETag": etag})
+
+
+async def handle_get_token(request):
+    provider = request.match_info["provider"]
+    if provider not in tokens:
+        return json_response({"error": f"Unknown provider: {provider}"}, status=404)
+    result = await get_token(provider)
+    return json_response(result, status=200 if result.get("success") or result.get("requires_2fa") else 500)
+
+
+async def handle_refresh(request):
+    # Both providers refresh concurrently; each joins a refresh that is
+    # already running rather than logging in twice
+    mmi_result, rpr_result = await asyncio.gather(
+        asyncio.shield(start_refresh("mmi")),
+        asyncio.shield(start_refresh("rpr")),
+    )
+    return json_response({
+        "mmi": mmi_result,
+        "rpr": rpr_result,
+    })
+
+
+async def handle_mmi_2fa(request):
+    body = await request.text()
+
+    try:
+        data = json_loads(body)
+        session_id = data.get("session_id")
+        code = data.get("code")
+
+        if not session_id or not code:
+            return json_response({"error": "session_id and code required"}, status=400)
+
+        async with extract_semaphores["mmi"]:
+            result = await extract_mmi_token(session_id=session_id, twofa_code=code)
+
+        if result.get("success"):
+            async with token_locks["mmi"]:
+                tokens["mmi"] = TokenEntry(
+                    token=result["token"],
+                    expires_at=result["expiresAt"],
+                    last_refresh=datetime.now().isoformat(),
+                )
+                save_token_cache()
+            return json_response(result)
+        return json_response(result, status=400 if "error" in result else 200)
+    except ValueError:
+        return json_response({"error": "Invalid JSON"}, status=400)
+    except Exception as e:
+        return json_response({"error": str(e)}, status=500)
+
+
+async def handle_mmi_2fa_status(request):
+    pending = [session["session_id"] for session in pending_2fa_sessions.values()]
+    return json_response({
+        "pending_sessions": len(pending),
+        "session_ids": pending,
+    })
+
+
+async def on_startup(app):
+    if PLAYWRIGHT_AVAILABLE:
+        app["browser_warmup"] = asyncio.create_task(warm_up_browser())
+    app["refresh_daemon"] = asyncio.create_task(proactive_refresh_daemon())
+    app["2fa_reaper"] = asyncio.create_task(reap_pending_2fa_sessions())
+    logger.info("[TokenService] Proactive refresh daemon started")
+
+
+async def on_cleanup(app):
+    logger.info("[TokenService] Shutting down...")
+    app["refresh_daemon"].cancel()
+    app["2fa_reaper"].cancel()
+    for task in refresh_tasks.values():
+        if task:
+            task.cancel()
+    if "browser_warmup" in app:
+        # Let an in-progress launch finish; cancelling Playwright mid-start can hang shutdown
+        await app["browser_warmup"]
+    await shutdown_browser()
+    await close_http_session()
+
+
+def create_app():
+    app = web.Application(middlewares=[http_middleware])
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/tokens/{provider}", handle_get_token)
+    app.router.add_post("/tokens/refresh", handle_refresh)
+    app.router.add_post("/tokens/mmi/2fa", handle_mmi_2fa)
+    app.router.add_post("/tokens/mmi/2fa/status", handle_mmi_2fa_status)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
 
 
 def main():
     port = int(os.environ.get("TOKEN_SERVICE_PORT", "8899"))
+    socket_path = os.environ.get("TOKEN_SERVICE_SOCKET") or None
 
     if not PLAYWRIGHT_AVAILABLE:
-        print("[TokenService] ERROR: Playwright not installed!", file=sys.stderr)
-        print("[TokenService] Run: pip3 install playwright && playwright install chromium", file=sys.stderr)
+        logger.error("[TokenService] ERROR: Playwright not installed!")
+        logger.error("[TokenService] Run: pip3 install -r requirements-token-service.txt && playwright install chromium")
         sys.exit(1)
 
-    print(f"[TokenService] Starting on port {port}...", file=sys.stderr)
-    print(f"[TokenService] MMI configured: {bool(os.environ.get('MMI_EMAIL'))}", file=sys.stderr)
-    print(f"[TokenService] RPR configured: {bool(os.environ.get('RPR_EMAIL'))}", file=sys.stderr)
-    print(f"[TokenService] Twilio configured: {bool(TWILIO_ACCOUNT_SID)}", file=sys.stderr)
-    print(f"[TokenService] Email alerts configured: {bool(OUTLOOK_TENANT_ID)}", file=sys.stderr)
-    print(f"[TokenService] Browser state dir: {BROWSER_STATE_DIR.absolute()}", file=sys.stderr)
+    logger.info(f"[TokenService] Starting on port {port}...")
+    logger.info(f"[TokenService] MMI configured: {bool(os.environ.get('MMI_EMAIL'))}")
+    logger.info(f"[TokenService] RPR configured: {bool(os.environ.get('RPR_EMAIL'))}")
+    logger.info(f"[TokenService] Twilio configured: {bool(TWILIO_ACCOUNT_SID)}")
+    logger.info(f"[TokenService] Email alerts configured: {bool(OUTLOOK_TENANT_ID)}")
+    logger.info(f"[TokenService] Browser state dir: {BROWSER_STATE_DIR.absolute()}")
+    if CHROMIUM_EXECUTABLE_PATH:
+        logger.info(f"[TokenService] Chromium executable: {CHROMIUM_EXECUTABLE_PATH}")
+
+    load_token_cache()
 
     # Check for existing storage states
     for provider in ["mmi", "rpr"]:
         sp = get_storage_state_path(provider)
         if sp.exists():
-            print(f"[TokenService] Found existing {provider} storage state: {sp}", file=sys.stderr)
-
-    # Start proactive refresh daemon
-    daemon_thread = threading.Thread(target=proactive_refresh_daemon, daemon=True)
-    daemon_thread.start()
-    print("[TokenService] Proactive refresh daemon started", file=sys.stderr)
-
-    server = HTTPServer(("0.0.0.0", port), TokenHandler)
-    print(f"[TokenService] Listening on http://0.0.0.0:{port}", file=sys.stderr)
-
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        print("[TokenService] Shutting down...", file=sys.stderr)
-        server.shutdown()
+            logger.info(f"[TokenService] Found existing {provider} storage state: {sp}")
+
+    logger.info(f"[TokenService] Listening on http://0.0.0.0:{port}")
+    if socket_path:
+        logger.info(f"[TokenService] Listening on unix:{socket_path}")
+    # The whole service (HTTP, refresh daemon, Playwright) shares this one loop
+    loop = uvloop.new_event_loop() if uvloop is not None else None
+    logger.info(f"[TokenService] Event loop: {'uvloop' if loop else 'asyncio'}")
+    web.run_app(create_app(), host="0.0.0.0", port=port, path=socket_path, print=None, access_log=None, loop=loop)
 
 
 if __name__ == "__main__":
@@ -2,13 +2,15 @@
 Configuration management for MCI Scraper service.
 """
 
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
 
 
 class Settings(BaseSettings):
     """Application settings loaded from environment variables."""
 
+    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
+
     # API Security
     api_key: str = "change-me-in-production"
 
@@ -17,19 +19,20 @@ class Settings(BaseSettings):
 
     # Browser Pool
     browser_pool_size: int = 3
+    browser_pool_min_size: int = 1  # Browsers kept running when idle; more start on demand
+    browser_idle_timeout_seconds: int = 300
     browser_headless: bool = True
+    browser_max_usage: int = 100  # Checks served before a driver is recycled
+    block_resources: bool = True  # Drop images, fonts and trackers the scraper never reads
 
     # Scraping
     page_timeout_seconds: int = 60
     captcha_timeout_seconds: int = 120
+    check_deadline_seconds: int = 180  # Budget for one whole payment check
 
     # Logging
     log_level: str = "INFO"
 
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
-
 
 @lru_cache()
 def get_settings() -> Settings:
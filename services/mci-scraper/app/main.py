@@ -6,6 +6,7 @@ Uses undetected-chromedriver to avoid bot detection.
 """
 
 from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 import structlog
 
@@ -54,6 +55,7 @@ app = FastAPI(
     description="Scrapes MyCoverageInfo.com to verify mortgagee payment status",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 
@@ -63,7 +63,7 @@ class PaymentCheckResponse(BaseModel):
     # Audit trail
     screenshot_base64: Optional[str] = Field(
         None,
-        description="Base64 encoded screenshot of result page",
+        description="Base64 encoded WEBP screenshot of result page",
     )
 
     # Error info
@@ -2,6 +2,8 @@
 Payment check endpoints for MCI Scraper.
 """
 
+from datetime import date
+
 from fastapi import APIRouter, HTTPException
 import structlog
 
@@ -79,6 +81,15 @@ async def check_payment(request: PaymentCheckRequest):
         )
 
 
+# Exact MCI payment statuses (lowercased) and the standard enum value each maps to
+_STATUS_MAP = {
+    "paid": "current",
+    "unpaid": "late",
+    "past due": "late",
+    "pending": "grace_period",
+}
+
+
 def _map_payment_status(status: str | None) -> str | None:
     """Map MCI payment status to our standard enum values."""
     if not status:
@@ -86,25 +97,23 @@ def _map_payment_status(status: str | None) -> str | None:
 
     status_lower = status.lower()
 
-    if status_lower == "paid":
-        return "current"
-    elif status_lower in ("unpaid", "past due"):
-        return "late"
-    elif status_lower == "pending":
-        return "grace_period"
-    elif "cancelled" in status_lower or "lapsed" in status_lower:
+    mapped = _STATUS_MAP.get(status_lower)
+    if mapped:
+        return mapped
+    if "cancelled" in status_lower or "lapsed" in status_lower:
         return "lapsed"
 
     return "unknown"
 
 
-def _parse_date(date_str: str | None):
+def _parse_date(date_str: str | None) -> date | None:
     """Parse MM/DD/YYYY date string to date object."""
     if not date_str:
         return None
 
+    # Fixed format, so split it directly instead of going through strptime
     try:
-        from datetime import datetime
-        return datetime.strptime(date_str, "%m/%d/%Y").date()
+        month, day, year = date_str.split("/")
+        return date(int(year), int(month), int(day))
     except ValueError:
         return None
@@ -4,7 +4,9 @@ Uses undetected-chromedriver to avoid bot detection.
 """
 
 import asyncio
-from typing import Optional
+import functools
+import time
+from typing import Any, Callable, Optional
 import structlog
 import undetected_chromedriver as uc
 from selenium.webdriver.chrome.options import Options
@@ -13,16 +15,56 @@ from app.config import settings
 
 logger = structlog.get_logger()
 
+# How often the idle reaper looks for browsers to shut down
+IDLE_REAP_INTERVAL_SECONDS = 60
+
+# Wipes the current origin's web storage between checks. Guarded because storage
+# access throws on opaque origins such as Chrome's error pages.
+CLEAR_STORAGE_JS = "try { localStorage.clear(); sessionStorage.clear(); } catch (e) {}"
+
+# Requests Chrome drops before fetching when settings.block_resources is on.
+# Stylesheets are kept: the modal and button waits depend on computed visibility.
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*hotjar.com*", "*facebook.net*",
+]
+
+
+async def run_blocking(func: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run a blocking call in the default thread pool.
+
+    Every WebDriver command is a synchronous HTTP round trip to chromedriver,
+    so calling one directly would stall the event loop for all other checks.
+    CPU-bound work such as results parsing goes through here as well.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
 
 class BrowserPool:
-    """Manages a pool of browser instances for parallel scraping."""
+    """
+    Manages a pool of browser instances for parallel scraping.
 
-    def __init__(self, max_size: int = 3):
+    The pool starts with min_size browsers and grows on demand up to max_size.
+    Browsers beyond min_size that sit idle for idle_timeout seconds are shut down.
+    """
+
+    def __init__(self, max_size: int = 3, min_size: int = 1, idle_timeout: float = 300.0):
         self.max_size = max_size
+        self.min_size = max(1, min(min_size, max_size))
+        self.idle_timeout = idle_timeout
         self._pool: list[uc.Chrome] = []
+        # id() of every pooled driver -> checks it has served; also the O(1) membership test in release
+        self._usage: dict[int, int] = {}
+        self._last_used: dict[int, float] = {}  # id() -> time.monotonic() it was last returned
+        self._launching = 0  # On-demand launches in progress, counted against max_size
         self._available: asyncio.Queue[uc.Chrome] = asyncio.Queue()
         self._lock = asyncio.Lock()
         self._initialized = False
+        self._reaper: Optional[asyncio.Task] = None
 
     async def initialize(self):
         """Initialize the browser pool."""
@@ -33,20 +75,31 @@ class BrowserPool:
             if self._initialized:
                 return
 
-            logger.info("Initializing browser pool", size=self.max_size)
+            logger.info("Initializing browser pool", size=self.min_size, max_size=self.max_size)
 
-            for i in range(self.max_size):
-                try:
-                    driver = self._create_driver()
-                    self._pool.append(driver)
-                    await self._available.put(driver)
-                    logger.info(f"Created browser instance {i + 1}/{self.max_size}")
-                except Exception as e:
-                    logger.error(f"Failed to create browser instance {i + 1}", error=str(e))
+            # The first launch runs alone because it is the one that downloads and
+            # patches chromedriver; the rest then start in parallel
+            await self._add_drivers(range(1, 2))
+            await self._add_drivers(range(2, self.min_size + 1))
 
+            self._reaper = asyncio.create_task(self._reap_idle())
             self._initialized = True
             logger.info("Browser pool initialized", available=self._available.qsize())
 
+    async def _add_drivers(self, numbers: range):
+        """Launch one driver per instance number concurrently and pool the ones that start."""
+        drivers = await asyncio.gather(
+            *(run_blocking(self._create_driver) for _ in numbers),
+            return_exceptions=True,
+        )
+        for i, driver in zip(numbers, drivers):
+            if isinstance(driver, BaseException):
+                logger.error(f"Failed to create browser instance {i}", error=str(driver))
+                continue
+            self._track(driver)
+            await self._available.put(driver)
+            logger.info(f"Created browser instance {i}/{self.max_size}")
+
     def _create_driver(self) -> uc.Chrome:
         """Create a new undetected Chrome driver instance."""
         options = uc.ChromeOptions()
@@ -66,11 +119,107 @@ class BrowserPool:
         options.add_argument("--disable-infobars")
         options.add_argument("--disable-notifications")
 
+        # driver.get returns at DOMContentLoaded instead of waiting for every
+        # subresource; each step waits on the element it needs anyway
+        options.page_load_strategy = "eager"
+
         driver = uc.Chrome(options=options)
         driver.set_page_load_timeout(settings.page_timeout_seconds)
 
+        if settings.block_resources:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+
         return driver
 
+    def _track(self, driver: uc.Chrome):
+        self._pool.append(driver)
+        self._usage[id(driver)] = 0
+        self._last_used[id(driver)] = time.monotonic()
+
+    def _untrack(self, driver: uc.Chrome):
+        self._pool.remove(driver)
+        self._usage.pop(id(driver), None)
+        self._last_used.pop(id(driver), None)
+
+    async def _grow(self) -> Optional[uc.Chrome]:
+        """Launch one more driver for a caller that found the pool empty."""
+        self._launching += 1
+        try:
+            driver = await run_blocking(self._create_driver)
+        except Exception as e:
+            logger.error("Failed to grow browser pool", error=str(e))
+            return None
+        finally:
+            self._launching -= 1
+
+        self._track(driver)
+        logger.info("Grew browser pool", total=len(self._pool), max_size=self.max_size)
+        return driver
+
+    async def _reap_idle(self):
+        """Shut down browsers idle longer than idle_timeout, down to min_size."""
+        while True:
+            await asyncio.sleep(IDLE_REAP_INTERVAL_SECONDS)
+            try:
+                # Sort the queue in one synchronous step so no acquire can race it
+                cutoff = time.monotonic() - self.idle_timeout
+                surplus = len(self._pool) - self.min_size
+                idle, kept = [], []
+                while not self._available.empty():
+                    driver = self._available.get_nowait()
+                    if len(idle) < surplus and self._last_used.get(id(driver), 0) < cutoff:
+                        idle.append(driver)
+                    else:
+                        kept.append(driver)
+                for driver in kept:
+                    self._available.put_nowait(driver)
+
+                for driver in idle:
+                    self._untrack(driver)
+                    try:
+                        await run_blocking(driver.quit)
+                    except Exception as e:
+                        logger.warning("Error closing browser", error=str(e))
+                if idle:
+                    logger.info("Reaped idle browsers", reaped=len(idle), total=len(self._pool))
+            except Exception as e:
+                logger.error("Idle browser reaper failed", error=str(e))
+
+    async def _replace(self, driver: uc.Chrome, reason: str) -> bool:
+        """
+        Swap a pooled driver for a fresh instance and make the new one available.
+
+        The replacement is created before the old driver is quit, so a failed
+        launch leaves the pool unchanged and returns False.
+        """
+        try:
+            new_driver = await run_blocking(self._create_driver)
+        except Exception as e:
+            logger.error("Failed to replace browser", reason=reason, error=str(e))
+            return False
+
+        self._untrack(driver)
+        try:
+            await run_blocking(driver.quit)
+        except Exception as e:
+            logger.warning("Error closing browser", error=str(e))
+
+        self._track(new_driver)
+        await self._available.put(new_driver)
+        logger.info("Replaced browser instance", reason=reason)
+        return True
+
+    async def _discard(self, driver: uc.Chrome, reason: str):
+        """Drop a driver from the pool and quit it without a replacement;
+        acquire() grows the pool back on demand."""
+        self._untrack(driver)
+        try:
+            await run_blocking(driver.quit)
+        except Exception as e:
+            logger.warning("Error closing browser", error=str(e))
+        logger.warning("Discarded browser instance", reason=reason, total=len(self._pool))
+
     async def acquire(self, timeout: float = 60.0) -> Optional[uc.Chrome]:
         """
         Acquire a browser instance from the pool.
@@ -84,52 +233,80 @@ class BrowserPool:
         if not self._initialized:
             await self.initialize()
 
+        if self._available.empty() and len(self._pool) + self._launching < self.max_size:
+            driver = await self._grow()
+            if driver is not None:
+                self._usage[id(driver)] += 1
+                return driver
+
         try:
             driver = await asyncio.wait_for(
                 self._available.get(),
                 timeout=timeout
             )
+            self._usage[id(driver)] += 1
             logger.debug("Browser acquired", available=self._available.qsize())
             return driver
         except asyncio.TimeoutError:
             logger.warning("Timeout waiting for browser instance")
             return None
 
-    async def release(self, driver: uc.Chrome):
-        """Release a browser instance back to the pool."""
-        if driver in self._pool:
-            try:
-                # Clear cookies and navigate away
-                driver.delete_all_cookies()
-                driver.get("about:blank")
-            except Exception as e:
-                logger.warning("Error cleaning up browser", error=str(e))
-                # Try to replace the broken driver
-                try:
-                    driver.quit()
-                    self._pool.remove(driver)
-                    new_driver = self._create_driver()
-                    self._pool.append(new_driver)
-                    await self._available.put(new_driver)
-                    logger.info("Replaced broken browser instance")
-                    return
-                except Exception as e2:
-                    logger.error("Failed to replace browser", error=str(e2))
+    async def release(self, driver: uc.Chrome, retire: bool = False):
+        """
+        Release a browser instance back to the pool.
 
-            await self._available.put(driver)
-            logger.debug("Browser released", available=self._available.qsize())
+        Args:
+            driver: Driver returned by acquire()
+            retire: Replace the driver with a fresh instance instead of reusing it,
+                e.g. when a check was abandoned with Selenium calls still in flight
+        """
+        usage = self._usage.get(id(driver))
+        if usage is None:
+            return
+
+        if retire:
+            # Never hand a retired driver to another check: it may still be
+            # running the abandoned check's Selenium command in a pool thread
+            if not await self._replace(driver, "retired"):
+                await self._discard(driver, "retired")
+            return
+
+        # Recycle long-lived Chromium before its native heap drifts
+        if usage >= settings.browser_max_usage and await self._replace(driver, "max_usage"):
+            return
+
+        try:
+            # Reset session state only. The tab stays on the MCI page so the
+            # next check navigates within a warm renderer and memory cache.
+            await run_blocking(driver.delete_all_cookies)
+            await run_blocking(driver.execute_script, CLEAR_STORAGE_JS)
+        except Exception as e:
+            logger.warning("Error cleaning up browser", error=str(e))
+            # Try to replace the broken driver
+            if await self._replace(driver, "broken"):
+                return
+
+        self._last_used[id(driver)] = time.monotonic()
+        await self._available.put(driver)
+        logger.debug("Browser released", available=self._available.qsize())
 
     async def cleanup(self):
         """Clean up all browser instances."""
         logger.info("Cleaning up browser pool")
 
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
         for driver in self._pool:
             try:
-                driver.quit()
+                await run_blocking(driver.quit)
             except Exception as e:
                 logger.warning("Error closing browser", error=str(e))
 
         self._pool.clear()
+        self._usage.clear()
+        self._last_used.clear()
         self._initialized = False
 
         # Clear the queue
@@ -143,8 +320,8 @@ class BrowserPool:
 
     @property
     def available_count(self) -> int:
-        """Number of available browser instances."""
-        return self._available.qsize()
+        """Number of checks that can start without waiting: idle browsers plus room to grow."""
+        return self._available.qsize() + max(0, self.max_size - len(self._pool) - self._launching)
 
     @property
     def total_count(self) -> int:
@@ -153,4 +330,8 @@ class BrowserPool:
 
 
 # Global browser pool instance
-browser_pool = BrowserPool(max_size=settings.browser_pool_size)
+browser_pool = BrowserPool(
+    max_size=settings.browser_pool_size,
+    min_size=settings.browser_pool_min_size,
+    idle_timeout=settings.browser_idle_timeout_seconds,
+)
@@ -3,6 +3,7 @@
 """
 
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 import structlog
 from twocaptcha import TwoCaptcha
@@ -15,10 +16,16 @@ logger = structlog.get_logger()
 class CaptchaSolver:
     """Wrapper for 2Captcha service."""
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, max_concurrent: int = 3):
         self.api_key = api_key
         self._solver: Optional[TwoCaptcha] = None
         self._balance: Optional[float] = None
+        # At most one solve per browser: extra requests wait here instead of
+        # piling blocking 2Captcha polls onto the shared default thread pool
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="captcha"
+        )
 
     @property
     def solver(self) -> TwoCaptcha:
@@ -55,15 +62,16 @@ class CaptchaSolver:
         )
 
         try:
-            # Run in thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: self.solver.recaptcha(
-                    sitekey=site_key,
-                    url=page_url,
+            # Run in the dedicated captcha pool to avoid blocking
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    self._executor,
+                    lambda: self.solver.recaptcha(
+                        sitekey=site_key,
+                        url=page_url,
+                    )
                 )
-            )
 
             if result and "code" in result:
                 logger.info("CAPTCHA solved successfully")
@@ -82,7 +90,7 @@ class CaptchaSolver:
             return None
 
         try:
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             balance = await loop.run_in_executor(
                 None,
                 self.solver.balance
@@ -101,4 +109,7 @@ class CaptchaSolver:
 
 
 # Global captcha solver instance
-captcha_solver = CaptchaSolver(settings.two_captcha_api_key)
+captcha_solver = CaptchaSolver(
+    settings.two_captcha_api_key,
+    max_concurrent=settings.browser_pool_size,
+)
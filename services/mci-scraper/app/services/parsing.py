@@ -0,0 +1,59 @@
+"""
+Text parsing helpers for the MyCoverageInfo results page.
+Pure functions over the page's innerText, kept free of the browser imports so
+they can be tested on their own.
+"""
+
+import re
+from typing import Dict
+
+# Labels whose value follows a colon on the results page
+LABEL_NAMES = (
+    "Additional Homeowner",
+    "Homeowner",
+    "Property Address",
+    "Loan Number",
+    "Policy Number",
+    "Insurance Company",
+)
+_NEXT_LABEL = r"(?:%s)\s*:" % "|".join(LABEL_NAMES)
+
+# The value may sit on the label's line or, when innerText splits label and
+# value into separate blocks, on the next one. It ends at the line end or at
+# another known label, so an empty label can't take the next label's line as
+# its value and two labels on one line each keep their own.
+_VALUE = (
+    r"[ \t]*\n?[ \t]*(?!" + _NEXT_LABEL + r")"
+    r"(?P<{field}>\S(?:(?!" + _NEXT_LABEL + r")[^\n])*)"
+)
+
+# All labels in one pass. The match is a zero-width lookahead so a value that
+# runs on to another label on the same line can't hide that label's match.
+LABELED_FIELDS_RE = re.compile(
+    "(?="
+    + "|".join(
+        label + _VALUE.format(field=field)
+        for label, field in (
+            (r"Additional Homeowner:", "additional_homeowner"),
+            (r"(?<!Additional )Homeowner:", "homeowner"),
+            (r"Property Address:", "property_address"),
+            (r"Loan Number\s*:", "loan_number"),
+            (r"Policy Number:", "policy_number"),
+            (r"Insurance Company:", "insurance_company"),
+        )
+    )
+    + ")",
+    re.IGNORECASE,
+)
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def extract_labeled_fields(text: str) -> Dict[str, str]:
+    """Return {field: value} for the "Label: value" fields in the page text.
+    The first occurrence of each label wins; whitespace is normalized."""
+    fields: Dict[str, str] = {}
+    for match in LABELED_FIELDS_RE.finditer(text):
+        field_name = match.lastgroup
+        if field_name not in fields:
+            fields[field_name] = WHITESPACE_RE.sub(" ", match.group(field_name).strip())
+    return fields
@@ -3,25 +3,41 @@ MyCoverageInfo Scraper Service.
 Handles the actual scraping of payment information using HTML parsing.
 """
 
+import asyncio
+import base64
+import io
 import re
 import time
-import asyncio
 from typing import Optional
 from dataclasses import dataclass, field
 from datetime import date
 import structlog
+from PIL import Image
 
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 
-from app.services.browser import browser_pool
+from app.services.browser import browser_pool, run_blocking
 from app.services.captcha import captcha_solver
+from app.services.parsing import extract_labeled_fields
 from app.config import settings
 
 logger = structlog.get_logger()
 
+# Audit screenshots are re-encoded from Chrome's PNG; WEBP at this quality keeps
+# the text legible at a fraction of the size
+SCREENSHOT_WEBP_QUALITY = 70
+
+
+def _encode_screenshot(png: bytes) -> str:
+    """Re-encode a PNG screenshot as base64 WEBP (CPU-bound; run via run_blocking)."""
+    out = io.BytesIO()
+    with Image.open(io.BytesIO(png)) as image:
+        image.save(out, format="WEBP", quality=SCREENSHOT_WEBP_QUALITY)
+    return base64.b64encode(out.getvalue()).decode("ascii")
+
 
 @dataclass
 class MCIResult:
@@ -59,7 +75,7 @@ class MCIResult:
     error_code: Optional[str] = None
     error_message: Optional[str] = None
 
-    # Screenshot for audit trail
+    # Screenshot for audit trail (base64 WEBP)
     screenshot_base64: Optional[str] = None
 
     # Performance
@@ -72,6 +88,82 @@ class MCIScraperService:
     MCI_URL = "https://www.mycoverageinfo.com/agent"
     RESULTS_URL_PATTERN = "/policy-manager/policy-info"
 
+    # Rendered text of the page, read natively in the browser
+    PAGE_TEXT_JS = "return document.body ? document.body.innerText : '';"
+
+    # Seconds _detect_captcha waits for the page's load event before checking
+    CAPTCHA_READY_TIMEOUT = 5
+
+    # Detects a reCAPTCHA and reads its site key in the same round trip
+    DETECT_CAPTCHA_JS = """
+        if (!document.querySelector(".g-recaptcha, [data-sitekey], iframe[src*='recaptcha']")) {
+            return null;
+        }
+        const widget = document.querySelector('.g-recaptcha');
+        return (widget && widget.getAttribute('data-sitekey')) || '';
+    """
+
+    # Puts a 2Captcha token into the reCAPTCHA response textarea. The token is passed
+    # as a script argument, never spliced into the source, and set as text rather
+    # than parsed as HTML.
+    INJECT_CAPTCHA_JS = """
+        const el = document.getElementById('g-recaptcha-response');
+        el.value = arguments[0];
+        el.textContent = arguments[0];
+        el.style.display = 'block';
+    """
+
+    # Fills the search inputs, given as {element id: value}, in one WebDriver round
+    # trip. Uses the native value setter and fires input/change so the page's
+    # framework sees the change. Returns the ids that were not found.
+    FILL_SEARCH_FORM_JS = """
+        const fields = arguments[0];
+        const setValue = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+        const missing = [];
+        for (const [id, value] of Object.entries(fields)) {
+            const el = document.getElementById(id);
+            if (!el) {
+                missing.push(id);
+                continue;
+            }
+            el.focus();
+            setValue.call(el, value);
+            el.dispatchEvent(new Event('input', {bubbles: true}));
+            el.dispatchEvent(new Event('change', {bubbles: true}));
+        }
+        return missing;
+    """
+
+    # Results page patterns, compiled once at import
+    POLICY_TYPE_RE = re.compile(r"(HOMEOWNERS|AUTO|UMBRELLA|DWELLING|FLOOD)", re.IGNORECASE)
+    POLICY_STATUS_RE = re.compile(r"(Policy Active|Policy Inactive|Policy Cancelled)", re.IGNORECASE)
+    EFFECTIVE_DATE_RE = re.compile(r"Effective Date\s+.*?\s+(\d{2}/\d{2}/\d{4})", re.IGNORECASE)
+    EXPIRATION_DATE_RE = re.compile(r"Expiration Date\s+.*?\s+(\d{2}/\d{2}/\d{4})", re.IGNORECASE)
+    # Dollar amounts after a label, in one pass. The match is a zero-width lookahead
+    # so one field's span can't swallow the next label, exactly like separate searches.
+    AMOUNTS_RE = re.compile(
+        r"(?=(Premium|Coverage Amount|Deductible)\s+.*?\s+\$?([\d,]+\.\d{2}))",
+        re.IGNORECASE,
+    )
+    AMOUNT_FIELDS = {
+        "premium": "premium",
+        "coverage amount": "coverage_amount",
+        "deductible": "deductible",
+    }
+    PAYMENT_STATUS_RE = re.compile(
+        r"(?:Payment Status|Status).*?(Paid|Unpaid|Pending|Past Due)", re.IGNORECASE
+    )
+    # Unlabeled status words, case-sensitive. None contains another, so findall
+    # sees every word a substring test would.
+    STATUS_WORDS_RE = re.compile(r"Paid|Unpaid|Past Due|Pending")
+    LAST_PAYMENT_RE = re.compile(r"\$([\d,]+\.\d{2})\s+on\s+(\d{2}/\d{2}/\d{4})", re.IGNORECASE)
+    MORTGAGEE_CLAUSE_RE = re.compile(
+        r"Mortgagee Clause:(.+?)(?=Submit|Add/Update|$)", re.DOTALL | re.IGNORECASE
+    )
+    WHITESPACE_RE = re.compile(r"\s+")
+    INLINE_SPACE_RE = re.compile(r"[ \t]+")
+    BLANK_LINES_RE = re.compile(r"\n\s*\n")
+
     def __init__(self):
         self.browser_pool = browser_pool
         self.captcha_solver = captcha_solver
@@ -96,6 +188,7 @@ class MCIScraperService:
         start_time = time.time()
         result = MCIResult()
         driver = None
+        retire_driver = False
 
         try:
             # Acquire browser from pool
@@ -105,64 +198,20 @@ class MCIScraperService:
                 result.error_message = "No browser instance available"
                 return result
 
-            # Navigate to MCI
-            logger.info("Navigating to MyCoverageInfo", url=self.MCI_URL)
-            driver.get(self.MCI_URL)
-            await asyncio.sleep(2)  # Wait for page load
-
-            # Fill search form
-            await self._fill_search_form(driver, loan_number, zip_code, last_name)
-
-            # Handle CAPTCHA if present
-            if await self._detect_captcha(driver):
-                logger.info("CAPTCHA detected, solving...")
-                solved = await self._solve_captcha(driver)
-                if not solved:
-                    result.error_code = "CAPTCHA_FAILED"
-                    result.error_message = "Failed to solve CAPTCHA"
-                    return result
-                logger.info("CAPTCHA solved successfully")
-
-            # Submit search
-            await self._submit_search(driver)
-
-            # Wait for results page
-            try:
-                WebDriverWait(driver, 15).until(
-                    EC.url_contains(self.RESULTS_URL_PATTERN)
-                )
-            except TimeoutException:
-                # Check for "not found" message
-                page_text = driver.find_element(By.TAG_NAME, "body").text
-                if "not found" in page_text.lower() or "no results" in page_text.lower():
-                    result.error_code = "NOT_FOUND"
-                    result.error_message = "Policy not found on MyCoverageInfo"
-                    return result
-
-                result.error_code = "TIMEOUT"
-                result.error_message = "Timeout waiting for results page"
-                return result
-
-            # Handle "Important Message" modal if present
-            await self._handle_modal(driver)
-
-            # Extract data from results page
-            page_text = driver.find_element(By.TAG_NAME, "body").text
-            await self._parse_results(result, page_text)
-
-            # Take screenshot for audit trail
-            try:
-                result.screenshot_base64 = driver.get_screenshot_as_base64()
-            except Exception as e:
-                logger.warning("Failed to take screenshot", error=str(e))
-
-            result.success = True
-            logger.info(
-                "Payment check completed",
-                payment_status=result.payment_status,
-                policy_number=result.policy_number,
+            # One budget for the whole check, however its time splits across steps
+            await asyncio.wait_for(
+                self._run_check(driver, result, loan_number, zip_code, last_name),
+                timeout=settings.check_deadline_seconds,
             )
 
+        except asyncio.TimeoutError:
+            # Selenium calls still running in the pool can't be interrupted, so
+            # the browser is retired rather than handed to the next check
+            retire_driver = True
+            result.error_code = "DEADLINE"
+            result.error_message = f"Check exceeded {settings.check_deadline_seconds}s deadline"
+            logger.error("Payment check deadline exceeded", deadline=settings.check_deadline_seconds)
+
         except TimeoutException:
             result.error_code = "TIMEOUT"
             result.error_message = "Page load timeout"
@@ -176,18 +225,93 @@ class MCIScraperService:
         finally:
             result.duration_ms = int((time.time() - start_time) * 1000)
             if driver:
-                await self.browser_pool.release(driver)
+                await self.browser_pool.release(driver, retire=retire_driver)
 
         return result
 
-    async def _fill_search_form(
+    async def _run_check(
+        self,
+        driver,
+        result: MCIResult,
+        loan_number: str,
+        zip_code: str,
+        last_name: Optional[str],
+    ):
+        """Drive one search on an acquired browser, filling in result."""
+        # Navigate to MCI
+        logger.info("Navigating to MyCoverageInfo", url=self.MCI_URL)
+        await run_blocking(driver.get, self.MCI_URL)
+
+        # Fill search form (waits for the loan number input itself)
+        await run_blocking(self._fill_search_form, driver, loan_number, zip_code, last_name)
+
+        # Handle CAPTCHA if present
+        site_key = await run_blocking(self._detect_captcha, driver)
+        if site_key is not None:
+            logger.info("CAPTCHA detected, solving...")
+            solved = await self._solve_captcha(driver, site_key)
+            if not solved:
+                result.error_code = "CAPTCHA_FAILED"
+                result.error_message = "Failed to solve CAPTCHA"
+                return
+            logger.info("CAPTCHA solved successfully")
+
+        # Submit search
+        await self._submit_search(driver)
+
+        # Wait for results page
+        try:
+            await run_blocking(
+                WebDriverWait(driver, 15).until,
+                EC.url_contains(self.RESULTS_URL_PATTERN),
+            )
+        except TimeoutException:
+            # Check for "not found" message
+            page_text = await run_blocking(self._page_text, driver)
+            if "not found" in page_text.lower() or "no results" in page_text.lower():
+                result.error_code = "NOT_FOUND"
+                result.error_message = "Policy not found on MyCoverageInfo"
+                return
+
+            result.error_code = "TIMEOUT"
+            result.error_message = "Timeout waiting for results page"
+            return
+
+        # Handle "Important Message" modal if present
+        await self._handle_modal(driver)
+
+        # Extract data from results page
+        page_text = await run_blocking(self._page_text, driver)
+        # Regex work over the whole page runs in the pool too, so it
+        # can't hold up the other checks' timers
+        await run_blocking(self._parse_results, result, page_text)
+
+        # Take screenshot for audit trail
+        try:
+            png = await run_blocking(driver.get_screenshot_as_png)
+            result.screenshot_base64 = await run_blocking(_encode_screenshot, png)
+        except Exception as e:
+            logger.warning("Failed to take screenshot", error=str(e))
+
+        result.success = True
+        logger.info(
+            "Payment check completed",
+            payment_status=result.payment_status,
+            policy_number=result.policy_number,
+        )
+
+    def _page_text(self, driver) -> str:
+        """Return the visible text of the current page in a single round trip."""
+        return driver.execute_script(self.PAGE_TEXT_JS) or ""
+
+    def _fill_search_form(
         self,
         driver,
         loan_number: str,
         zip_code: str,
         last_name: Optional[str]
     ):
-        """Fill in the MCI search form."""
+        """Fill in the MCI search form (blocking; run via run_blocking)."""
         logger.debug("Filling search form", loan_number=loan_number[:4] + "****")
 
         # Wait for form to be ready
@@ -195,43 +319,39 @@ class MCIScraperService:
             EC.presence_of_element_located((By.ID, "loanInput"))
         )
 
-        # Clear and fill loan number
-        loan_input = driver.find_element(By.ID, "loanInput")
-        loan_input.clear()
-        loan_input.send_keys(loan_number)
+        # Replace (not append to) each value in a single script call
+        fields = {"loanInput": loan_number, "zipInput": zip_code}
+        if last_name:
+            fields["lastNameInput"] = last_name
+        missing = driver.execute_script(self.FILL_SEARCH_FORM_JS, fields)
 
-        # Clear and fill ZIP code
-        zip_input = driver.find_element(By.ID, "zipInput")
-        zip_input.clear()
-        zip_input.send_keys(zip_code)
+        if "zipInput" in missing:
+            raise NoSuchElementException("ZIP code field not found")
+        if "lastNameInput" in missing:
+            logger.debug("Last name field not found")
 
-        # Fill last name if provided
-        if last_name:
-            try:
-                last_name_input = driver.find_element(By.ID, "lastNameInput")
-                last_name_input.clear()
-                last_name_input.send_keys(last_name)
-            except NoSuchElementException:
-                logger.debug("Last name field not found")
+    def _detect_captcha(self, driver) -> Optional[str]:
+        """
+        Check if CAPTCHA is present on page (blocking; run via run_blocking).
 
-    async def _detect_captcha(self, driver) -> bool:
-        """Check if CAPTCHA is present on page."""
+        Returns:
+            None if there is no CAPTCHA, else the reCAPTCHA site key
+            ("" when the widget carries none)
+        """
+        # Pages load "eager" (DOMContentLoaded), but the reCAPTCHA widget can be
+        # inserted by async scripts after that; give the page a bounded wait to
+        # finish loading before the one-shot check
         try:
-            driver.find_element(
-                By.CSS_SELECTOR,
-                ".g-recaptcha, [data-sitekey], iframe[src*='recaptcha']"
+            WebDriverWait(driver, self.CAPTCHA_READY_TIMEOUT).until(
+                lambda d: d.execute_script("return document.readyState") == "complete"
             )
-            return True
-        except NoSuchElementException:
-            return False
+        except TimeoutException:
+            logger.debug("Page still loading, checking for CAPTCHA anyway")
+        return driver.execute_script(self.DETECT_CAPTCHA_JS)
 
-    async def _solve_captcha(self, driver) -> bool:
+    async def _solve_captcha(self, driver, site_key: str) -> bool:
         """Solve reCAPTCHA using 2Captcha service."""
         try:
-            # Find site key
-            recaptcha_elem = driver.find_element(By.CLASS_NAME, "g-recaptcha")
-            site_key = recaptcha_elem.get_attribute("data-sitekey")
-
             if not site_key:
                 logger.error("Could not find reCAPTCHA site key")
                 return False
@@ -239,7 +359,7 @@ class MCIScraperService:
             # Solve via 2Captcha
             solution = await self.captcha_solver.solve_recaptcha(
                 site_key=site_key,
-                page_url=driver.current_url,
+                page_url=await run_blocking(lambda: driver.current_url),
                 timeout=settings.captcha_timeout_seconds,
             )
 
@@ -247,12 +367,7 @@ class MCIScraperService:
                 return False
 
             # Inject solution into page
-            driver.execute_script(
-                f"document.getElementById('g-recaptcha-response').innerHTML='{solution}';"
-            )
-            driver.execute_script(
-                "document.getElementById('g-recaptcha-response').style.display='block';"
-            )
+            await run_blocking(driver.execute_script, self.INJECT_CAPTCHA_JS, solution)
 
             return True
 
@@ -263,127 +378,94 @@ class MCIScraperService:
     async def _submit_search(self, driver):
         """Submit the search form."""
         try:
-            search_button = driver.find_element(
-                By.XPATH, '//button[text()="Search"]'
+            search_button = await run_blocking(
+                driver.find_element, By.XPATH, '//button[text()="Search"]'
             )
-            search_button.click()
-            await asyncio.sleep(1)  # Brief wait after click
+            await run_blocking(search_button.click)
         except NoSuchElementException:
             # Try alternative button selectors
             try:
-                search_button = driver.find_element(
-                    By.CSS_SELECTOR, 'button[type="submit"]'
+                search_button = await run_blocking(
+                    driver.find_element, By.CSS_SELECTOR, 'button[type="submit"]'
                 )
-                search_button.click()
+                await run_blocking(search_button.click)
             except NoSuchElementException:
                 logger.warning("Search button not found, trying form submit")
-                driver.find_element(By.TAG_NAME, "form").submit()
+                form = await run_blocking(driver.find_element, By.TAG_NAME, "form")
+                await run_blocking(form.submit)
 
     async def _handle_modal(self, driver):
         """Handle any "Important Message" modal that appears."""
         try:
-            continue_button = WebDriverWait(driver, 5).until(
-                EC.element_to_be_clickable((By.XPATH, '//button[text()="Continue"]'))
+            continue_button = await run_blocking(
+                WebDriverWait(driver, 5).until,
+                EC.element_to_be_clickable((By.XPATH, '//button[text()="Continue"]')),
+            )
+            await run_blocking(continue_button.click)
+            # Wait for the modal to actually close rather than a fixed pause
+            await run_blocking(
+                WebDriverWait(driver, 5).until,
+                EC.invisibility_of_element(continue_button),
             )
-            continue_button.click()
-            await asyncio.sleep(2)
             logger.debug("Dismissed modal dialog")
         except TimeoutException:
             pass  # Modal not present, continue normally
 
-    async def _parse_results(self, result: MCIResult, page_text: str):
-        """Parse data from the results page using regex."""
+    def _parse_results(self, result: MCIResult, page_text: str):
+        """Parse data from the results page using regex (CPU-bound; run via run_blocking)."""
         logger.debug("Parsing results page")
 
-        # Homeowner info
-        result.homeowner = self._extract_regex(
-            page_text, r"Homeowner:\s*(.+?)(?:\n|$)"
-        )
-        result.additional_homeowner = self._extract_regex(
-            page_text, r"Additional Homeowner:\s*(.+?)(?:\n|$)"
-        )
-        result.property_address = self._extract_regex(
-            page_text, r"Property Address:\s*(.+?)(?:\n|$)"
-        )
+        # Homeowner, address, loan and policy number, carrier: one scan over the page
+        self._extract_labeled_fields(result, page_text)
 
-        # Loan and policy info
-        result.loan_number = self._extract_regex(
-            page_text, r"Loan Number\s*:\s*(.+?)(?:\n|$)"
-        )
-        result.policy_type = self._extract_regex(
-            page_text, r"(HOMEOWNERS|AUTO|UMBRELLA|DWELLING|FLOOD)"
-        )
-        result.policy_status = self._extract_regex(
-            page_text, r"(Policy Active|Policy Inactive|Policy Cancelled)"
-        )
-        result.policy_number = self._extract_regex(
-            page_text, r"Policy Number:\s*(.+?)(?:\n|$)"
-        )
-        result.insurance_company = self._extract_regex(
-            page_text, r"Insurance Company:\s*(.+?)(?:\n|$)"
-        )
+        # Policy type and status
+        result.policy_type = self._extract_regex(page_text, self.POLICY_TYPE_RE)
+        result.policy_status = self._extract_regex(page_text, self.POLICY_STATUS_RE)
 
         # Dates
-        result.effective_date = self._extract_regex(
-            page_text, r"Effective Date\s+.*?\s+(\d{2}/\d{2}/\d{4})"
-        )
-        result.expiration_date = self._extract_regex(
-            page_text, r"Expiration Date\s+.*?\s+(\d{2}/\d{2}/\d{4})"
-        )
-
-        # Financial - parse dollar amounts
-        premium_str = self._extract_regex(
-            page_text, r"Premium\s+.*?\s+\$?([\d,]+\.\d{2})"
-        )
-        if premium_str:
-            result.premium = self._parse_currency(premium_str)
+        result.effective_date = self._extract_regex(page_text, self.EFFECTIVE_DATE_RE)
+        result.expiration_date = self._extract_regex(page_text, self.EXPIRATION_DATE_RE)
 
-        coverage_str = self._extract_regex(
-            page_text, r"Coverage Amount\s+.*?\s+\$?([\d,]+\.\d{2})"
-        )
-        if coverage_str:
-            result.coverage_amount = self._parse_currency(coverage_str)
-
-        deductible_str = self._extract_regex(
-            page_text, r"Deductible\s+.*?\s+\$?([\d,]+\.\d{2})"
-        )
-        if deductible_str:
-            result.deductible = self._parse_currency(deductible_str)
+        # Financial - parse dollar amounts; the first amount after each label wins
+        for match in self.AMOUNTS_RE.finditer(page_text):
+            field_name = self.AMOUNT_FIELDS[match.group(1).lower()]
+            if getattr(result, field_name) is None:
+                setattr(result, field_name, self._parse_currency(match.group(2)))
 
         # CRITICAL: Payment status
-        result.payment_status = self._extract_regex(
-            page_text, r"(?:Payment Status|Status).*?(Paid|Unpaid|Pending|Past Due)"
-        )
+        result.payment_status = self._extract_regex(page_text, self.PAYMENT_STATUS_RE)
         if not result.payment_status:
-            # Try alternate patterns
-            if "Paid" in page_text:
+            # Try alternate patterns: collect the bare status words in one scan,
+            # then apply the same precedence as before
+            found = set(self.STATUS_WORDS_RE.findall(page_text))
+            if "Paid" in found:
                 result.payment_status = "Paid"
-            elif "Unpaid" in page_text or "Past Due" in page_text:
+            elif "Unpaid" in found or "Past Due" in found:
                 result.payment_status = "Unpaid"
-            elif "Pending" in page_text:
+            elif "Pending" in found:
                 result.payment_status = "Pending"
 
         # Last payment info
-        last_payment_str = self._extract_regex(
-            page_text, r"\$([\d,]+\.\d{2})\s+on\s+(\d{2}/\d{2}/\d{4})"
-        )
-        if last_payment_str:
-            # The regex returns a tuple if there are groups
-            match = re.search(r"\$([\d,]+\.\d{2})\s+on\s+(\d{2}/\d{2}/\d{4})", page_text)
-            if match:
-                result.last_payment_amount = self._parse_currency(match.group(1))
-                result.last_payment_date = match.group(2)
+        match = self.LAST_PAYMENT_RE.search(page_text)
+        if match:
+            result.last_payment_amount = self._parse_currency(match.group(1))
+            result.last_payment_date = match.group(2)
 
         # Mortgagee clause
         result.mortgagee_clause = self._extract_mortgagee_clause(page_text)
 
-    def _extract_regex(self, text: str, pattern: str) -> Optional[str]:
-        """Extract data using regex pattern."""
-        match = re.search(pattern, text, re.IGNORECASE)
+    def _extract_labeled_fields(self, result: MCIResult, text: str):
+        """Fill the "Label: value" fields (see parsing.extract_labeled_fields)."""
+        for field_name, value in extract_labeled_fields(text).items():
+            setattr(result, field_name, value)
+
+    def _extract_regex(self, text: str, pattern: re.Pattern) -> Optional[str]:
+        """Extract the first group of a compiled pattern."""
+        match = pattern.search(text)
         if match:
             value = match.group(1).strip()
             # Clean up common issues
-            value = re.sub(r"\s+", " ", value)  # Normalize whitespace
+            value = self.WHITESPACE_RE.sub(" ", value)  # Normalize whitespace
             return value
         return None
 
@@ -398,16 +480,12 @@ class MCIScraperService:
 
     def _extract_mortgagee_clause(self, text: str) -> Optional[str]:
         """Extract mortgagee clause information."""
-        match = re.search(
-            r"Mortgagee Clause:(.+?)(?=Submit|Add/Update|$)",
-            text,
-            re.DOTALL | re.IGNORECASE
-        )
+        match = self.MORTGAGEE_CLAUSE_RE.search(text)
         if match:
             clause = match.group(1).strip()
             # Clean up extra whitespace but preserve line breaks
-            clause = re.sub(r"[ \t]+", " ", clause)
-            clause = re.sub(r"\n\s*\n", "\n", clause)
+            clause = self.INLINE_SPACE_RE.sub(" ", clause)
+            clause = self.BLANK_LINES_RE.sub("\n", clause)
             return clause
         return None
 
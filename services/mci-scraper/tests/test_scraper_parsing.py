@@ -0,0 +1,47 @@
+"""Results-page parsing tests for the MCI scraper."""
+
+from app.services.parsing import extract_labeled_fields
+
+
+def test_labeled_fields():
+    fields = extract_labeled_fields(
+        "Homeowner: Jane Doe\n"
+        "Additional Homeowner: John Doe\n"
+        "Property Address: 1 Main St\n"
+        "Loan Number : 12345\n"
+        "Policy Number: HO-987\n"
+        "Insurance Company: Acme Mutual"
+    )
+    assert fields == {
+        "homeowner": "Jane Doe",
+        "additional_homeowner": "John Doe",
+        "property_address": "1 Main St",
+        "loan_number": "12345",
+        "policy_number": "HO-987",
+        "insurance_company": "Acme Mutual",
+    }
+
+
+def test_empty_label_does_not_swallow_next_label():
+    # Single-owner policies show a blank "Additional Homeowner:" label
+    fields = extract_labeled_fields("Additional Homeowner:\nProperty Address: 1 Main St")
+    assert fields == {"property_address": "1 Main St"}
+
+    fields = extract_labeled_fields("Homeowner: Jane Doe\nAdditional Homeowner:  \nLoan Number: 42")
+    assert fields == {"homeowner": "Jane Doe", "loan_number": "42"}
+
+
+def test_value_on_next_line():
+    # innerText splits label and value when they are separate block elements
+    fields = extract_labeled_fields("Loan Number:\n123\nPolicy Number:\nHO-1")
+    assert fields == {"loan_number": "123", "policy_number": "HO-1"}
+
+
+def test_two_labels_on_one_line():
+    fields = extract_labeled_fields("Loan Number: 123\tPolicy Number: HO-987")
+    assert fields == {"loan_number": "123", "policy_number": "HO-987"}
+
+
+def test_homeowner_not_taken_from_additional_homeowner():
+    fields = extract_labeled_fields("Additional Homeowner: Bob\nHomeowner: Jane")
+    assert fields == {"additional_homeowner": "Bob", "homeowner": "Jane"}